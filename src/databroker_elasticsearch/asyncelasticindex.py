@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""\
+Class for access to Elasticsearch index from asyncio coroutines.
+"""
+
+import itertools
+
+from databroker_elasticsearch.elasticindex import ElasticIndexBase
+
+
+class AsyncElasticIndex(ElasticIndexBase):
+    """Asynchronous counterpart of `ElasticIndex`.
+
+    The methods that communicate with Elasticsearch are coroutines
+    which use the `AsyncElasticsearch` client.  The documents are
+    filtered and transformed with the same `criteria` and `mapper`
+    as in `ElasticIndex` and thus produce identical ES entries.
+    Only the methods defined here are available, the bulk loading,
+    versioning and maintenance methods of `ElasticIndex` have no
+    asynchronous counterpart.
+
+    Parameters
+    ----------
+    es : AsyncElasticsearch, str, or dict
+        The asynchronous Elasticsearch client to push entries to.
+        When `str` or `dict` type, instantiate a new AsyncElasticsearch
+        object using this argument.
+    index : str
+        The index to use in Elasticsearch
+    mapper : callable, optional
+        A function to transform input document to Elasticsearch entry.
+    criteria : callable, optional
+        Callable which is run on all the start document, if the return is
+        truthy the document is sent to ES else, it is not added. Defaults
+        to True for all documents
+    hashfield : str, optional
+        The name of ES field for content hash of each entry.
+
+    See Also
+    --------
+    ElasticIndex : description of the attributes.
+    """
+
+    def __init__(self, es, index, mapper=None, criteria=None,
+                 hashfield=None):
+        from elasticsearch import AsyncElasticsearch
+        aes = (AsyncElasticsearch(es) if isinstance(es, str)
+               else AsyncElasticsearch(**es) if isinstance(es, dict)
+               else es)
+        super().__init__(aes, index, mapper=mapper, criteria=criteria,
+                         hashfield=hashfield)
+        return
+
+
+    async def close(self):
+        """Close the connections of the asynchronous ES client.
+        """
+        await self.es.close()
+        return
+
+
+    async def _agenerate(self, docs):
+        """Produce transformed entries from sync or async iterable.
+
+        Yield
+        -----
+        tuple
+            The pairs of (_id, _source) for ES entry identifier and body.
+        """
+        if not hasattr(docs, '__aiter__'):
+            for e in self._generate(docs):
+                yield e
+            return
+        async for doc in docs:
+            for e in self._generate((doc,)):
+                yield e
+        pass
+
+
+    async def _ensure_index_exists(self):
+        """Create and reset the index if it does not exist yet.
+        """
+        if self.index == self._verified_index:
+            return
+        if not await self.es.indices.exists(self.index):
+            await self.reset()
+            assert await self.es.indices.exists(self.index)
+        self._verified_index = self.index
+        return
+
+
+    async def reset(self):
+        """Remove all data from the `index` and set it up anew.
+
+        Set up mappings for the Elasticsearch `doc_type` according to
+        `doc_properties`, `doc_dynamic` and `doc_templates`.
+        When `index` is an alias, delete the indices it points to.
+        """
+        if await self.es.indices.exists_alias(name=self.index):
+            current = await self.es.indices.get_alias(name=self.index)
+            await self.es.indices.delete(index=','.join(current))
+        else:
+            await self.es.indices.delete(index=self.index,
+                                         ignore_unavailable=True)
+        await self.es.indices.create(index=self.index)
+        await self.es.indices.put_mapping(
+            doc_type=self.doc_type, index=self.index,
+            body=self._mappingbody())
+        return
+
+
+    async def qsearch(self, q=None, **kwargs):
+        """
+        Search this index using Lucene query string syntax.
+
+        See `ElasticIndex.qsearch` for description of arguments.
+
+        Returns
+        -------
+        dict
+            The Elasticsearch response with matching hits.
+        """
+        kw = self._search_arguments(q, kwargs)
+        rv = await self.es.search(**kw)
+        return rv
+
+
+    async def ingest(self, doc):
+        """Convert and insert one document to ES if it passes `criteria`.
+
+        When `index` does not exist, call `reset` to set it up.
+
+        Returns
+        -------
+        int
+            Number of added documents, 0 or 1.
+        """
+        cnt = 0
+        await self._ensure_index_exists()
+        for i, body in self._generate([doc]):
+            await self.es.index(index=self.index, doc_type=self.doc_type,
+                                id=i, body=body)
+            cnt += 1
+        return cnt
+
+
+    async def devour(self, docs):
+        """Convert and add many documents to ES if they pass `criteria`.
+
+        When `index` does not exist, call `reset` to set it up.
+
+        Parameters
+        ----------
+        docs : iterable or async iterable
+            The input documents of dictionary type.
+
+        Returns
+        -------
+        int
+            Number of added documents.
+        """
+        rv = await self.upload(self._agenerate(docs))
+        return rv
+
+
+    async def upload(self, entries):
+        """Add already converted entries to ES in bulk.
+
+        When `index` does not exist, call `reset` to set it up.
+
+        Parameters
+        ----------
+        entries : iterable or async iterable
+            The sequence of (_id, _source) pairs for ES entry identifier
+            and body.
+
+        Returns
+        -------
+        int
+            Number of added entries.
+        """
+        from elasticsearch.helpers import async_bulk
+        await self._ensure_index_exists()
+        res = await async_bulk(self.es, self._actions(entries))
+        return res[0]
+
+
+    async def amend(self, updates):
+        """Apply partial updates to existing entries in ES.
+
+        See `ElasticIndex.amend` for description of arguments.
+
+        Returns
+        -------
+        int
+            Number of updated entries.
+        """
+        from elasticsearch.helpers import async_bulk
+        ii = iter(updates)
+        head = list(itertools.islice(ii, 2))
+        if not head:
+            return 0
+        await self._ensure_index_exists()
+        if len(head) == 1:
+            i, fields = head[0]
+            res = await self.es.update(
+                index=self.index, doc_type=self.doc_type,
+                id=i, body={"doc": fields}, ignore=404)
+            rv = int('error' not in res)
+            return rv
+        actions = ({"_op_type": "update", "_index": self.index,
+                    "_type": self.doc_type, "_id": i, "doc": fields}
+                   for i, fields in itertools.chain(head, ii))
+        res = await async_bulk(self.es, actions, raise_on_error=False)
+        return res[0]
+
+
+    async def _actions(self, entries):
+        "Produce bulk index actions from sync or async iterable."
+        a = {"_index": self.index, "_type": self.doc_type}
+        if hasattr(entries, '__aiter__'):
+            async for i, src in entries:
+                yield dict(a, _id=i, _source=src)
+            return
+        for i, src in entries:
+            yield dict(a, _id=i, _source=src)
+        pass
+
+# end of class
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""\
+Efficient retrieval of run start data from databroker metadatastore.
+"""
+
+
+def startdocs(db, since=None, fields=None, uids=None, batchsize=1000):
+    """Iterate over raw run start documents in databroker.
+
+    When the metadatastore is backed by MongoDB, page the documents
+    directly from the run start collection in batches of `batchsize`
+    and sorted by "time".  For other backends use `find_run_starts`
+    of the metadatastore or the "start" metadata of a v2 catalog.
+    In either case no `Header` objects are built.
+
+    Parameters
+    ----------
+    db : databroker.Broker or intake.Catalog
+        The databroker instance or v2 catalog to be queried.
+    since : float, optional
+        The earliest "time" of the returned run start documents.
+    fields : list, optional
+        The names of start document fields to be read from MongoDB.
+        The "uid" and "time" fields are always included.  Read the
+        whole documents when not specified.  This is ignored for
+        other backends.
+    uids : iterable, optional
+        Return only the runs with these uids.  The runs are looked up
+        with one "$in" query per `batchsize` uids and unknown uids
+        are skipped.
+    batchsize : int, optional
+        The number of documents in one MongoDB cursor batch.
+
+    Yield
+    -----
+    dict
+        The run start document without the MongoDB "_id" item.
+    """
+    query = {} if since is None else {'time': {'$gte': since}}
+    if uids is None:
+        yield from _finddocs(db, query, fields, batchsize)
+        return
+    uids = list(uids)
+    for i in range(0, len(uids), batchsize):
+        q = dict(query, uid={'$in': uids[i:i + batchsize]})
+        yield from _finddocs(db, q, fields, batchsize)
+    pass
+
+
+def _finddocs(db, query, fields, batchsize):
+    "Iterate over run start documents that match MongoDB `query`."
+    runstarts = _mongocollection(db)
+    if runstarts is not None:
+        projection = {'_id': False}
+        if fields is not None:
+            projection.update((f, True) for f in fields)
+            projection.update(uid=True, time=True)
+        cursor = runstarts.find(query, projection, sort=[('time', 1)],
+                                batch_size=batchsize)
+        for d in cursor:
+            yield d
+        return
+    hs = getattr(db, 'hs', None)
+    if hs is not None:
+        for d in hs.mds.find_run_starts(**query):
+            yield d
+        return
+    catalog = db.search(query) if query else db
+    for run in catalog.values():
+        yield run.metadata['start']
+    pass
+
+
+def _mongocollection(db):
+    "Return pymongo collection of run start documents or None."
+    try:
+        from pymongo.collection import Collection
+    except ImportError:
+        return None
+    hs = getattr(db, 'hs', None)
+    cat = getattr(db, 'v2', db)
+    candidates = (
+        getattr(hs.mds, '_runstart_col', None) if hs is not None else None,
+        getattr(cat, '_run_start_collection', None),
+    )
+    for c in candidates:
+        if isinstance(c, Collection):
+            return c
+    return None
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""\
+Summary of bulk operations sent to Elasticsearch.
+"""
+
+import collections
+
+
+class BulkStats:
+    """Counts of successful and failed items in bulk requests.
+
+    Attributes
+    ----------
+    indexed : int
+        The number of entries acknowledged by Elasticsearch.
+    retried : int
+        The number of entries which were sent again after they were
+        rejected by busy Elasticsearch.  An entry is counted once for
+        every repeated attempt.
+    failed : int
+        The number of entries which were rejected by Elasticsearch.
+    errors : collections.Counter
+        The number of failed entries per Elasticsearch error type.
+    failures : list
+        The bulk responses for all failed entries.
+    unchanged : int
+        The number of entries which were not sent, because they
+        were already stored in ES with the same content, or which
+        were not created, because they already existed in ES.
+    chunk_size : int or None
+        The number of entries per bulk request.  This is the final
+        tuned value when the chunk size was adjusted at runtime.
+    chunk_bytes : int or None
+        The final tuned limit of bytes per bulk request or None
+        when the limit was not adjusted.
+    """
+
+    def __init__(self):
+        self.indexed = 0
+        self.retried = 0
+        self.failed = 0
+        self.errors = collections.Counter()
+        self.failures = []
+        self.unchanged = 0
+        self.chunk_size = None
+        self.chunk_bytes = None
+        return
+
+
+    def __repr__(self):
+        rv = ("BulkStats(indexed={}, retried={}, failed={}, errors={}, "
+              "chunk_size={}, chunk_bytes={})"
+              .format(self.indexed, self.retried, self.failed,
+                      dict(self.errors), self.chunk_size, self.chunk_bytes))
+        return rv
+
+
+    def add(self, ok, item):
+        """Account for one item result from a bulk helper function.
+
+        Parameters
+        ----------
+        ok : bool
+            The success flag of the item.
+        item : dict
+            The response for the item as returned by the
+            `elasticsearch.helpers.streaming_bulk` function.
+        """
+        if ok:
+            self.indexed += 1
+            return
+        self.failed += 1
+        self.errors[_errortype(item)] += 1
+        self.failures.append(item)
+        return
+
+# end of class
+
+
+def isrejected(item):
+    """Return True if bulk item was rejected, because ES was too busy.
+
+    Such items fail with HTTP status 429 and es_rejected_execution_exception
+    and can be retried later.
+    """
+    info = next(iter(item.values()), {}) if item else {}
+    rv = isinstance(info, dict) and info.get('status') == 429
+    return rv
+
+
+def isconflict(item):
+    """Return True if bulk item failed, because the entry already exists.
+
+    Such items fail with HTTP status 409 for the "create" operation.
+    """
+    info = next(iter(item.values()), {}) if item else {}
+    rv = isinstance(info, dict) and info.get('status') == 409
+    return rv
+
+
+def _errortype(item):
+    "Extract error type from a failed bulk item response."
+    info = next(iter(item.values()), {}) if item else {}
+    err = info.get('error', 'unknown') if isinstance(info, dict) else info
+    rv = err.get('type', 'unknown') if isinstance(err, dict) else str(err)
+    return rv
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""\
+Persistent progress record of a long running rebuild.
+"""
+
+import json
+import os
+
+
+class Checkpoint:
+    """Position of the last acknowledged document in a rebuild sequence.
+
+    The checkpoint is stored as a small JSON file which is replaced
+    atomically on every `save`, so that it stays valid even when the
+    process is killed.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the checkpoint file.
+
+    Attributes
+    ----------
+    filename : str
+        The path to the checkpoint file.
+    count : int
+        The number of input documents that were processed.
+    uid : str or None
+        The "uid" of the last processed input document.
+    indexed : int
+        The number of entries acknowledged by Elasticsearch.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.clear()
+        return
+
+
+    def clear(self):
+        """Reset the checkpoint to the start of a sequence.
+        """
+        self.count = 0
+        self.uid = None
+        self.indexed = 0
+        return
+
+
+    def advance(self, docs, indexed):
+        """Record that input documents were processed.
+
+        Parameters
+        ----------
+        docs : list
+            The input documents processed since the last checkpoint.
+        indexed : int
+            The number of entries from `docs` added to Elasticsearch.
+        """
+        if docs:
+            self.count += len(docs)
+            self.uid = docs[-1].get('uid')
+        self.indexed += indexed
+        return
+
+
+    def load(self):
+        """Read the checkpoint file if it exists.
+
+        Returns
+        -------
+        bool
+            True if the checkpoint was loaded from the file.
+        """
+        self.clear()
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename) as fp:
+            data = json.load(fp)
+        self.count = data['count']
+        self.uid = data['uid']
+        self.indexed = data['indexed']
+        return True
+
+
+    def save(self):
+        """Atomically write the checkpoint file.
+        """
+        data = dict(count=self.count, uid=self.uid, indexed=self.indexed)
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump(data, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpfile, self.filename)
+        return
+
+
+    def remove(self):
+        """Delete the checkpoint file.
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        return
+
+# end of class
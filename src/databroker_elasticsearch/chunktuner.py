@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""\
+Runtime adjustment of bulk request size to the Elasticsearch response time.
+"""
+
+import time
+
+
+class ChunkTuner:
+    """Split bulk entries to chunks with size tuned to a target latency.
+
+    The chunk is limited both by the number of entries and by the
+    total size of their serialized sources.  After each bulk request
+    both limits are scaled by the ratio of `target_latency` to the
+    measured request time, but at most by a factor of 2.  The limits
+    are halved when Elasticsearch rejects some items as too busy.
+
+    Parameters
+    ----------
+    serializer : object
+        The Elasticsearch serializer with the `dumps` method, usually
+        ``es.transport.serializer``.
+    target_latency : float
+        The desired duration of one bulk request in seconds.
+    chunk_size : int, optional
+        The initial maximum number of entries in one chunk.
+    chunk_bytes : int, optional
+        The initial maximum size of serialized entries in one chunk.
+
+    Attributes
+    ----------
+    target_latency : float
+        The desired duration of one bulk request in seconds.
+    chunk_size : int
+        The current maximum number of entries in one chunk.
+    chunk_bytes : int
+        The current maximum size of serialized entries in one chunk.
+    """
+
+    min_chunk_size = 10
+    max_chunk_size = 10000
+    min_chunk_bytes = 64 * 1024
+    max_chunk_bytes = 100 * 1024 * 1024
+
+    def __init__(self, serializer, target_latency,
+                 chunk_size=500, chunk_bytes=5 * 1024 * 1024):
+        self.serializer = serializer
+        self.target_latency = target_latency
+        self.chunk_size = chunk_size
+        self.chunk_bytes = chunk_bytes
+        return
+
+
+    def chunks(self, entries):
+        """Group bulk entries into chunks within the current limits.
+
+        Parameters
+        ----------
+        entries : iterable
+            The (_id, _source) pairs to be sent to Elasticsearch.
+
+        Yield
+        -----
+        list
+            The (_id, _source) pairs to be sent in one bulk request,
+            where `_source` is serialized to a string which is passed
+            unchanged to Elasticsearch.
+        """
+        chunk = []
+        nbytes = 0
+        for i, src in entries:
+            if not isinstance(src, (str, bytes)):
+                src = self.serializer.dumps(src)
+            if chunk and (len(chunk) >= self.chunk_size or
+                          nbytes + len(src) > self.chunk_bytes):
+                yield chunk
+                chunk = []
+                nbytes = 0
+            chunk.append((i, src))
+            nbytes += len(src)
+        if chunk:
+            yield chunk
+        pass
+
+
+    def timer(self):
+        "Return start time for measuring the bulk request latency."
+        return time.monotonic()
+
+
+    def update(self, t0, rejected=False):
+        """Adjust chunk limits after a bulk request.
+
+        Parameters
+        ----------
+        t0 : float
+            The start time of the request as returned by `timer`.
+        rejected : bool, optional
+            Flag for items rejected by busy Elasticsearch.
+        """
+        elapsed = time.monotonic() - t0
+        if rejected:
+            scale = 0.5
+        else:
+            scale = self.target_latency / max(elapsed, 1e-3)
+            scale = min(2.0, max(0.5, scale))
+        csize = int(self.chunk_size * scale)
+        self.chunk_size = min(self.max_chunk_size,
+                              max(self.min_chunk_size, csize))
+        cbytes = int(self.chunk_bytes * scale)
+        self.chunk_bytes = min(self.max_chunk_bytes,
+                               max(self.min_chunk_bytes, cbytes))
+        return
+
+# end of class
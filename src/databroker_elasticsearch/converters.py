@@ -4,6 +4,7 @@
 Functions for converting values that are exported to Elasticsearch.
 """
 
+import copy
 from collections.abc import MutableMapping, Sequence
 
 # handle registration of converter functions ---------------------------------
@@ -21,11 +22,85 @@ def getconverter(name):
     "Return converter function of the specified name."
     return _converters[name]
 
+
+def register_batch(f):
+    """Decorator to mark up batch implementation of converter `f`.
+
+    The batch function takes a list of non-None values and returns
+    a list of their conversions by `f` with the same length.
+    """
+    def decorate(fbatch):
+        _batchconverters[f] = fbatch
+        return fbatch
+    return decorate
+
+_batchconverters = {}
+
+
+def getbatchconverter(f):
+    """Return batch implementation of converter `f` or None.
+
+    The batch function is either registered with `register_batch`
+    or provided as the "batch" attribute of `f`.
+    """
+    rv = getattr(f, 'batch', None)
+    if rv is None:
+        try:
+            rv = _batchconverters.get(f)
+        except TypeError:
+            pass
+    return rv
+
+
+def register_esproperty(f, prop, items=None):
+    """Set Elasticsearch mapping type for the values returned by `f`.
+
+    Parameters
+    ----------
+    f : callable
+        The converter function.
+    prop : dict
+        The Elasticsearch mapping property of converted values.
+    items : dict, optional
+        The mapping property of all fields in the converted values
+        when they are dictionaries with arbitrary keys.
+    """
+    _esproperties[f] = (prop, items)
+    return
+
+_esproperties = {}
+
+
+def getesproperty(f):
+    """Return Elasticsearch mapping property for the output of `f`.
+
+    The property is either registered with `register_esproperty`
+    or provided as the "esproperty" attribute of `f`.
+
+    Returns
+    -------
+    prop : dict or None
+        The Elasticsearch mapping property or None when unknown.
+    items : dict or None
+        The mapping property of items of dictionary output.
+    """
+    rv = getattr(f, 'esproperty', None)
+    if rv is not None:
+        return copy.deepcopy(rv), None
+    try:
+        rv = _esproperties.get(f, (None, None))
+    except TypeError:
+        rv = (None, None)
+    return copy.deepcopy(rv)
+
 # define and register converter functions ------------------------------------
 
 register_converter(int)
 register_converter(float)
 register_converter(str)
+register_esproperty(int, {"type": "long"})
+register_esproperty(float, {"type": "double"})
+register_esproperty(str, {"type": "keyword"})
 
 
 @register_converter
@@ -59,6 +134,43 @@ def toisoformat(epoch):
     assert len(rv) in (25, 29)
     return rv
 
+register_esproperty(toisoformat, {
+    "type": "date", "format": "strict_date_optional_time||epoch_second"})
+
+
+@register_batch(toisoformat)
+def toisoformat_many(epochs):
+    """Convert a list of epoch seconds to elasticsearch friendly ISO times.
+
+    Batch version of `toisoformat`.  The local time zone is evaluated
+    once per 15 minutes interval, because offset changes happen at
+    such boundaries.
+
+    Parameters
+    ----------
+    epochs : list of float
+        The times in seconds since POSIX epoch in 1970.
+
+    Returns
+    -------
+    list of str
+        The ISO formatted dates as returned by `toisoformat`.
+    """
+    from datetime import datetime
+    fromtimestamp = datetime.fromtimestamp
+    tzcache = {}
+    rv = []
+    for epoch in epochs:
+        epochms = round(epoch, 3)
+        k = epochms // 900
+        tz = tzcache.get(k)
+        if tz is None:
+            tz = tzcache[k] = fromtimestamp(k * 900).astimezone().tzinfo
+        dt = fromtimestamp(epochms, tz)
+        ts = 'milliseconds' if dt.microsecond else 'auto'
+        rv.append(dt.isoformat(timespec=ts))
+    return rv
+
 
 @register_converter
 def normalize_counts(d):
@@ -83,6 +195,9 @@ def normalize_counts(d):
     rv.update((k, v / totalcount) for k, v in d.items())
     return rv
 
+register_esproperty(normalize_counts, {"type": "object", "dynamic": True},
+                    items={"type": "double"})
+
 
 @register_converter
 def listofstrings(v):
@@ -92,3 +207,17 @@ def listofstrings(v):
     if isinstance(v, Sequence) and all(isinstance(w, str) for w in v):
         rv = v
     return rv
+
+register_esproperty(listofstrings, {"type": "keyword"})
+
+
+@register_converter
+def text(x):
+    """Convert argument to a string for full-text search.
+
+    Same as `str`, but the Elasticsearch field is analyzed "text"
+    instead of the exact-value "keyword".
+    """
+    return str(x)
+
+register_esproperty(text, {"type": "text"})
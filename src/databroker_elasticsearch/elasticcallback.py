@@ -4,27 +4,104 @@
 Callback for adding data to elastic search from run engine.
 """
 
+import collections
+import contextlib
+import itertools
+import logging
+
 from bluesky.callbacks.core import CallbackBase
 from databroker_elasticsearch.elasticindex import ElasticIndex
 
+logger = logging.getLogger(__name__)
+
 
 class ElasticCallback(CallbackBase):
     """
     Callback for inserting start metadata into an `Elasticsearch` instance.
 
     This wraps `ElasticIndex` adapter for adding translated documents to
-    a given Elasticsearch index.
+    a given Elasticsearch index.  The "stop" document of the run updates
+    the existing ES entry with "exit_status", "complete", "reason",
+    "duration" and "num_events" fields.  With `eventstats` enabled
+    the update also has "stats" field with count, min, max and mean
+    of every scalar numeric data key in the run events.
+
+    Parameters
+    ----------
+    esindex : ElasticIndex
+        The ElasticIndex object for converting and inserting documents.
+    background : bool, optional
+        When True, send "start" documents to Elasticsearch from
+        a dedicated worker thread so that `start` returns at once.
+    queuesize : int, optional
+        The maximum number of documents waiting for the background
+        worker.  Only used when `background` is True.
+    batchsize : int, optional
+        When larger than one, coalesce up to `batchsize` "start"
+        documents into a single bulk request.  This implies `background`.
+    batchtime : float, optional
+        The maximum time in seconds that a "start" document waits
+        for other documents in the same bulk request.
+    spool : str, optional
+        The path to a write-ahead spool file for converted "start"
+        documents.  When set, documents that could not be sent to
+        Elasticsearch are kept in the spool and sent with the next
+        insertion or with `replay`.  Spool errors are logged
+        instead of being raised.
+    eventstats : bool, optional
+        When True, compute running statistics of scalar event data
+        and store them in the ES entry at the end of the run.
 
     Attributes
     ----------
     esindex : ElasticIndex
         The ElasticIndex object for converting documents and inserting
         them to Elasticsearch.
+    worker : IngestWorker or None
+        The background worker which sends "start" documents to
+        Elasticsearch.  None when documents are sent synchronously.
+    spool : DocumentSpool or None
+        The write-ahead storage of entries waiting to be sent.
+    eventstats : bool
+        The flag for computing statistics of scalar event data.
+    stop_properties : dict
+        The mapping properties of fields added by the "stop" document.
+        They are added to `ElasticIndex.doc_properties` of `esindex`
+        unless defined there.
     """
 
+    stop_properties = {
+        "exit_status": {"type": "keyword"},
+        "complete": {"type": "boolean"},
+        "reason": {"type": "text"},
+        "duration": {"type": "double"},
+        "num_events": {"type": "long"},
+        "stats": {"type": "object", "dynamic": True},
+    }
+
 
-    def __init__(self, esindex: ElasticIndex):
+    def __init__(self, esindex: ElasticIndex,
+                 background=False, queuesize=1000,
+                 batchsize=1, batchtime=1.0, spool=None, eventstats=False):
         self.esindex = esindex
+        for name, prop in self.stop_properties.items():
+            esindex.doc_properties.setdefault(name, dict(prop))
+        self.eventstats = eventstats
+        # start documents of the runs that have not stopped yet
+        self._openruns = {}
+        # EventStats objects per run start uid and per descriptor uid
+        self._runstats = {}
+        self._descstats = {}
+        self.spool = None
+        if spool is not None:
+            from databroker_elasticsearch.spool import DocumentSpool
+            self.spool = DocumentSpool(spool)
+        self.worker = None
+        if background or batchsize > 1:
+            from databroker_elasticsearch.ingestworker import IngestWorker
+            self.worker = IngestWorker(self._send, maxsize=queuesize,
+                                       batchsize=batchsize,
+                                       batchtime=batchtime)
         return
 
 
@@ -38,6 +115,9 @@ class ElasticCallback(CallbackBase):
         config : dict
             The configuration dictionary that describes ElasticIndex.
             It must contain "databroker-elasticsearch" key.
+            The optional "background", "queuesize", "batchsize",
+            "batchtime", "spool" and "eventstats" items in that section
+            are passed to the class constructor.
 
         Returns
         -------
@@ -45,11 +125,119 @@ class ElasticCallback(CallbackBase):
         """
         from databroker_elasticsearch.elasticindex import ElasticIndex
         esindex = ElasticIndex.from_config(config)
-        rv = cls(esindex)
+        cfg = config['databroker-elasticsearch']
+        options = ('background', 'queuesize', 'batchsize', 'batchtime',
+                   'spool', 'eventstats')
+        kw = {k: cfg[k] for k in options if k in cfg}
+        rv = cls(esindex, **kw)
+        return rv
+
+
+    @property
+    def queue_depth(self):
+        "Number of documents waiting for the background worker."
+        rv = 0 if self.worker is None else self.worker.qsize
         return rv
 
 
-    def rebuild(self, headers, purge=False):
+    def flush(self):
+        """Block until all queued documents are sent to Elasticsearch.
+
+        This has no effect when documents are sent synchronously.
+        """
+        if self.worker is not None:
+            self.worker.flush()
+        return
+
+
+    def close(self):
+        """Send all queued documents and stop the background worker.
+        """
+        if self.worker is not None:
+            self.worker.close()
+        return
+
+
+    def replay(self):
+        """Send entries left in the spool to Elasticsearch.
+
+        Returns
+        -------
+        int
+            The number of entries that were added to Elasticsearch.
+        """
+        if self.spool is None:
+            return 0
+        self.flush()
+        cnt = self.spool.replay(self.esindex)
+        return cnt
+
+
+    def _send(self, items):
+        """Insert a list of bluesky documents to Elasticsearch.
+
+        Parameters
+        ----------
+        items : list
+            The ``("start", startdoc)`` or
+            ``("stop", (startdoc, stopdoc, stats))`` pairs.
+            The "start" documents are converted and indexed, the "stop"
+            items produce partial updates of the start entries.
+
+        When `spool` is in use, record the converted documents in
+        the spool and then send all spooled entries.
+        """
+        docs = [doc for name, doc in items if name == 'start']
+        updates = [u for name, runpair in items if name == 'stop'
+                   for u in self._stopupdates(*runpair)]
+        if self.spool is None:
+            if len(docs) == 1:
+                self.esindex.ingest(docs[0])
+            elif docs:
+                self.esindex.devour(docs)
+            if updates:
+                self.esindex.amend(updates)
+            return
+        self.spool.append(self.esindex._generate(docs))
+        self.spool.append(updates, op='update')
+        # do not block the RunEngine thread with retry delays
+        kw = {} if self.worker is not None else {'max_retries': 0}
+        try:
+            self.spool.replay(self.esindex, **kw)
+        except Exception:
+            logger.exception("Failed to send spooled entries, "
+                             "they are kept in %s.", self.spool.filename)
+        return
+
+
+    def _stopupdates(self, startdoc, stopdoc, stats=None):
+        """Generate partial update for the ES entry of a finished run.
+
+        Yield
+        -----
+        tuple
+            The (_id, fields) pair for the entry of `startdoc`.
+            Nothing is produced when `startdoc` does not pass `criteria`.
+        """
+        fields = {
+            "exit_status": stopdoc.get('exit_status'),
+            "complete": stopdoc.get('exit_status') == 'success',
+        }
+        if stopdoc.get('reason'):
+            fields['reason'] = stopdoc['reason']
+        if 'time' in startdoc and 'time' in stopdoc:
+            fields['duration'] = stopdoc['time'] - startdoc['time']
+        if 'num_events' in stopdoc:
+            fields['num_events'] = sum(stopdoc['num_events'].values())
+        if stats:
+            fields['stats'] = stats
+        for i, _ in self.esindex._generate([startdoc]):
+            yield (i, fields)
+        pass
+
+
+    def rebuild(self, headers, purge=False, checkpoint=None, resume=False,
+                versioned=False, keep=2, bulkload=None, **kwargs):
         """Export start documents in given headers to Elasticsearch index.
 
         Parameters
@@ -59,24 +247,396 @@ class ElasticCallback(CallbackBase):
             This is usually an iterable of `databroker.Header` objects.
         purge : bool, optional
             When True purge the Elasticsearch index before adding headers.
+            The index is not purged when resuming from a checkpoint.
+        checkpoint : str, optional
+            The path to a checkpoint file which is updated from the
+            per-entry bulk results after every `chunk_size` headers
+            processed in order.  The file is removed when the rebuild
+            completes.
+        resume : bool, optional
+            When True, continue from an existing `checkpoint` file by
+            skipping headers that were already exported.  The `headers`
+            must be in the same order as for the interrupted rebuild.
+        versioned : bool, optional
+            When True, export to a new versioned index ``<index>-v<N>``
+            and then atomically point the `index` alias to it, so that
+            searches use the previous content until the rebuild is
+            complete.  Documents added to the previous version during
+            the rebuild are not copied, use `sync` to add them.
+        keep : int, optional
+            The number of versioned indices retained after the
+            `versioned` rebuild, including the new one.
+        bulkload : bool, optional
+            When True, disable index refresh and replicas during the
+            rebuild with `ElasticIndex.bulkload`.  The default is True
+            for `purge` or `versioned` rebuild and False otherwise.
+        kwargs : misc, optional
+            Options passed to `ElasticIndex.devour`, for example
+            ``processes=8`` for mapping documents in a process pool
+            or ``threads=4`` for parallel bulk requests.  Use
+            ``progress=True`` to report progress to stderr or pass
+            a `Progress` object for custom reporting.
 
         Returns
         -------
-        int
-            The number of documents that were added to Elasticsearch.
+        int or BulkStats
+            The number of documents that were added to Elasticsearch
+            or the `BulkStats` summary when called with ``stats=True``.
+            The count includes documents added before the checkpoint.
+
+        Raises
+        ------
+        ValueError
+            When the resumed `headers` do not match the checkpoint
+            or when resuming a `versioned` rebuild.
         """
         startdocs = (hdr.start for hdr in headers)
-        if purge:
-            self.esindex.reset()
-        cnt = self.esindex.devour(startdocs)
-        return cnt
+        total = len(headers) if hasattr(headers, '__len__') else None
+        rv = self._rebuild(startdocs, total=total, purge=purge,
+                           checkpoint=checkpoint, resume=resume,
+                           versioned=versioned, keep=keep,
+                           bulkload=bulkload, **kwargs)
+        return rv
+
+
+    def rebuilddb(self, db, since=None, fields=None, **kwargs):
+        """Export start documents read directly from databroker storage.
+
+        This is a faster equivalent of ``rebuild(db())``, which pages
+        raw start documents from the metadatastore and does not build
+        `databroker.Header` objects.
+
+        Parameters
+        ----------
+        db : databroker.Broker or intake.Catalog
+            The databroker instance or v2 catalog with runs to export.
+        since : float, optional
+            Export only runs with the same or later start "time".
+        fields : list, optional
+            The names of start document fields to be read from MongoDB.
+            This must include all fields used by `ElasticIndex.mapper`
+            and `ElasticIndex.criteria`.  Read whole documents when not
+            specified.
+        kwargs : misc, optional
+            Options passed to `rebuild`, for example ``purge=True``.
+
+        Returns
+        -------
+        int or BulkStats
+            The number of documents that were added to Elasticsearch
+            or the `BulkStats` summary when called with ``stats=True``.
+
+        See Also
+        --------
+        brokersource.startdocs : the source of start documents.
+        """
+        from databroker_elasticsearch.brokersource import startdocs
+        docs = startdocs(db, since=since, fields=fields)
+        rv = self._rebuild(docs, **kwargs)
+        return rv
+
+
+    def rebuildfile(self, source, **kwargs):
+        """Export start documents streamed from a JSON dump file.
+
+        Parameters
+        ----------
+        source : str or file
+            The path to a file with JSON array or newline-delimited JSON
+            of start documents, optionally gzip compressed.
+        kwargs : misc, optional
+            Options passed to `rebuild`, for example ``purge=True``.
+
+        Returns
+        -------
+        int or BulkStats
+            The number of documents that were added to Elasticsearch
+            or the `BulkStats` summary when called with ``stats=True``.
+
+        See Also
+        --------
+        filesource.startdocs : the source of start documents.
+        """
+        from databroker_elasticsearch.filesource import startdocs
+        rv = self._rebuild(startdocs(source), **kwargs)
+        return rv
+
+
+    def _rebuild(self, startdocs, total=None, purge=False, checkpoint=None,
+                 resume=False, versioned=False, keep=2, bulkload=None,
+                 **kwargs):
+        """Export start documents to the current or versioned index.
+
+        The `total` is the number of `startdocs` if known and it is
+        used for the progress ETA.  See `rebuild` for description of
+        other arguments and return value.
+        """
+        progress = kwargs.get('progress')
+        if progress is True:
+            from databroker_elasticsearch.progress import Progress
+            progress = kwargs['progress'] = Progress(total=total)
+        if bulkload is None:
+            bulkload = purge or versioned
+        if resume and versioned:
+            raise ValueError("Versioned rebuild cannot be resumed.")
+        if not versioned:
+            rv = self._export(self.esindex, startdocs, purge,
+                              checkpoint, resume, bulkload, **kwargs)
+        else:
+            target = self.esindex.nextversion()
+            rv = self._export(target, startdocs, False,
+                              checkpoint, False, bulkload, **kwargs)
+            self.esindex.publish(target.index, keep=keep)
+        if progress:
+            progress.done()
+        return rv
+
+
+    def _export(self, esindex, startdocs, purge, checkpoint, resume,
+                bulkload, **kwargs):
+        """Export start documents to the given ElasticIndex.
+
+        See `rebuild` for description of arguments and return value.
+        """
+        if checkpoint is None:
+            if purge:
+                esindex.reset()
+            with esindex.bulkload() if bulkload else contextlib.ExitStack():
+                cnt = esindex.devour(startdocs, **kwargs)
+            return cnt
+        from databroker_elasticsearch.checkpoint import Checkpoint
+        ckpt = Checkpoint(checkpoint)
+        if resume and ckpt.load():
+            startdocs = iter(startdocs)
+            nskipped = 0
+            lastuid = None
+            for doc in itertools.islice(startdocs, ckpt.count):
+                nskipped += 1
+                lastuid = doc.get('uid')
+            if nskipped != ckpt.count or lastuid != ckpt.uid:
+                emsg = "Headers do not match checkpoint {}.".format(
+                    checkpoint)
+                raise ValueError(emsg)
+            progress = kwargs.get('progress')
+            if progress and progress.total is not None:
+                progress.total -= ckpt.count
+        elif purge:
+            esindex.reset()
+        with esindex.bulkload() if bulkload else contextlib.ExitStack():
+            bst = self._devourcheckpointed(esindex, startdocs, ckpt,
+                                           **kwargs)
+        ckpt.remove()
+        if kwargs.get('stats'):
+            return bst
+        if bst.failed:
+            from elasticsearch.helpers import BulkIndexError
+            emsg = "{} document(s) failed to index.".format(bst.failed)
+            raise BulkIndexError(emsg, bst.failures)
+        return ckpt.indexed
+
+
+    def _devourcheckpointed(self, esindex, startdocs, ckpt, **kwargs):
+        """Export documents in one stream and advance checkpoint on results.
+
+        The checkpoint moves over the leading documents whose entries
+        were acknowledged or failed or which produced no entry.  It is
+        saved after every `chunk_size` documents passed.
+
+        Returns
+        -------
+        BulkStats
+            The summary of entries sent in this run.
+        """
+        chunk_size = kwargs.get('chunk_size', 500)
+        pending = collections.deque()
+        finished = {}
+        head = 0
+        unsaved = 0
+
+        def tracked(docs):
+            for doc in docs:
+                pending.append(doc)
+                yield doc
+            pass
+
+        def onresult(pos, ok):
+            nonlocal head, unsaved
+            finished[pos] = ok
+            done = []
+            indexed = 0
+            while head in finished:
+                indexed += finished.pop(head) is True
+                done.append(pending.popleft())
+                head += 1
+            ckpt.advance(done, indexed)
+            unsaved += len(done)
+            if unsaved >= chunk_size:
+                ckpt.save()
+                unsaved = 0
+            return
+
+        kwargs.update(stats=True, onresult=onresult)
+        bst = esindex.devour(tracked(startdocs), **kwargs)
+        return bst
+
+
+    def sync(self, db, overlap=600, **kwargs):
+        """Export databroker runs that are newer than the index content.
+
+        Find the latest "time" in the Elasticsearch index and export
+        only start documents of the runs which started after that time
+        minus `overlap`.  Export all runs when the index is empty.
+        The entries are sent with the bulk "create" operation so that
+        runs which are already indexed, possibly with "stop" fields
+        and event statistics, are left unchanged.
+
+        Parameters
+        ----------
+        db : databroker.Broker
+            The databroker instance with runs to be exported.
+        overlap : float, optional
+            The time in seconds subtracted from the latest indexed
+            time to include runs which were saved late.
+        kwargs : misc, optional
+            Options passed to `rebuilddb` except for `purge`
+            and `versioned`.
+
+        Returns
+        -------
+        int or BulkStats
+            The number of documents that were added to Elasticsearch
+            or the `BulkStats` summary when called with ``stats=True``.
+        """
+        for name in ('purge', 'versioned'):
+            if kwargs.get(name):
+                emsg = "sync does not support the {} argument.".format(name)
+                raise TypeError(emsg)
+        t = self.esindex.maxtime()
+        since = None if t is None else t - overlap
+        kwargs.setdefault('op_type', 'create')
+        rv = self.rebuilddb(db, since=since, **kwargs)
+        return rv
+
+
+    def reconcile(self, db, **kwargs):
+        """Make the index content consistent with the runs in databroker.
+
+        Compare the `_id` of every ES entry with the identifiers that
+        the runs in databroker map to.  The identifier of a run is
+        converted from its "uid" field alone by `ElasticIndex.entryid`.
+        First delete the ES entries which do not belong to any run,
+        then fetch the runs missing in the index in batches of uids
+        and export them.  Missing runs rejected by
+        `ElasticIndex.criteria` are skipped again.
+
+        Parameters
+        ----------
+        db : databroker.Broker or intake.Catalog
+            The databroker instance with the reference set of runs.
+        kwargs : misc, optional
+            Options passed to `ElasticIndex.devour` for missing runs.
+
+        Returns
+        -------
+        added : int
+            The number of entries added to Elasticsearch.
+        deleted : int
+            The number of orphaned entries deleted from Elasticsearch.
+
+        Raises
+        ------
+        ValueError
+            When the mapper produces no `_id` from the "uid" of a run.
+            Nothing is deleted in such case.
+        """
+        from databroker_elasticsearch.brokersource import startdocs
+        esindex = self.esindex
+        esids = set(esindex.scanids())
+        runids = set()
+        missing = []
+        for d in startdocs(db, fields=['uid']):
+            i = esindex.entryid({'uid': d['uid']})
+            if i is None:
+                emsg = "Mapper produced no _id from uid {!r}.".format(
+                    d['uid'])
+                raise ValueError(emsg)
+            runids.add(i)
+            if i not in esids:
+                missing.append(d['uid'])
+        # delete before export so that no new entry is removed
+        deleted = esindex.remove(esids.difference(runids))
+        added = 0
+        if missing:
+            added = esindex.devour(startdocs(db, uids=missing), **kwargs)
+        return added, deleted
 
     # override CallbackBase function
 
     def start(self, doc):
         """Handle "start" document in bluesky run engine callback.
         """
-        # TODO implement `complete=true/false` flag for successful vs
-        # failed measurements.  Needs `stop` callback to set the status.
-        self.esindex.ingest(doc)
+        self._openruns[doc.get('uid')] = doc
+        if self.eventstats:
+            from databroker_elasticsearch.eventstats import EventStats
+            self._runstats[doc.get('uid')] = EventStats()
+        self._submit('start', doc)
+        return
+
+
+    def descriptor(self, doc):
+        """Handle "descriptor" document in bluesky run engine callback.
+        """
+        stats = self._runstats.get(doc.get('run_start'))
+        if stats is not None:
+            stats.add_descriptor(doc)
+            self._descstats[doc['uid']] = stats
+        return
+
+
+    def event(self, doc):
+        """Handle "event" document in bluesky run engine callback.
+        """
+        stats = self._descstats.get(doc.get('descriptor'))
+        if stats is not None:
+            stats.add_event(doc)
+        return
+
+
+    def event_page(self, doc):
+        """Handle "event_page" document in bluesky run engine callback.
+        """
+        stats = self._descstats.get(doc.get('descriptor'))
+        if stats is not None:
+            stats.add_event_page(doc)
+        return
+
+
+    def stop(self, doc):
+        """Handle "stop" document in bluesky run engine callback.
+
+        Update the ES entry of the run with its exit status, duration
+        and number of events.  Tell the background worker to send
+        pending documents without waiting for a full batch.
+        """
+        runuid = doc.get('run_start')
+        startdoc = self._openruns.pop(runuid, None)
+        stats = self._runstats.pop(runuid, None)
+        summary = None
+        if stats is not None:
+            for duid in stats.scalarkeys:
+                self._descstats.pop(duid, None)
+            summary = stats.summary()
+        if startdoc is not None:
+            self._submit('stop', (startdoc, doc, summary))
+        if self.worker is not None:
+            self.worker.flush(wait=False)
+        return
+
+
+    def _submit(self, name, doc):
+        "Send document now or pass it to the background worker."
+        if self.worker is not None:
+            self.worker.submit((name, doc))
+        else:
+            self._send([(name, doc)])
         return
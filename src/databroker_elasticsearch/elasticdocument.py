@@ -4,7 +4,12 @@
 Class for translating dictionary document to Elasticsearch entry.
 """
 
-from databroker_elasticsearch.converters import getconverter
+import collections
+import fnmatch
+import re
+
+from databroker_elasticsearch.converters import (
+    getconverter, getbatchconverter, getesproperty, noconversion)
 
 
 class ElasticDocument:
@@ -21,7 +26,16 @@ class ElasticDocument:
         The specification of dictionary conversion provided as
         a list of tuples ``(keyin, keyout, converter)``.
         Each tuple sets ``docout[keyout] = converter(docin[keyin])``
-        with missing keys in docin silently ignored.
+        with missing keys in docin silently ignored.  The `keyin`
+        may be a dotted path with list indices such as
+        ``"sample.composition"`` or ``"md.detectors[0].name"``, for
+        reading from nested dictionaries and lists.  The `keyin`
+        with "*" or "?" characters is a glob pattern and `keyin`
+        enclosed in slashes such as ``"/pba\\d_adc\\d offset/"`` is
+        a regular expression, both of which select all matching
+        top-level keys.  The `keyout` of pattern entries defaults to
+        the matched key, otherwise it is expanded by `re.Match.expand`
+        so that it can refer to regular expression groups.
         The tuples may be abbreviated to one or two entries which
         will imply ``keyout = keyin`` and ``converter = noconversion``.
         The `converter` can be either a callable or a string name
@@ -34,8 +48,26 @@ class ElasticDocument:
         This equals the `docmap` argument of class initialization
         except that abbreviated `docmap` entries are expanded and
         string-type converters replaced with corresponding function.
+    newdict : bool
+        Flag that the conversion returns a new dictionary which can be
+        modified by the caller.  Used by `ElasticIndex` to avoid copies.
+
+    Notes
+    -----
+    The `docmap` is compiled at initialization to specialized Python
+    functions, which look up every input key or path prefix once,
+    have `noconversion` inlined and fill the output dictionary in one
+    pass.  Changes of the `docmap` attribute apply only after calling
+    `compile`.  When `docmap` has pattern entries, the functions are
+    generated for every distinct sequence of input keys and cached,
+    so that documents with the same key layout are converted without
+    pattern matching.
     """
 
+    maxplans = 1000
+
+    newdict = True
+
     def __init__(self, docmap):
         self.docmap = []
         for specs in docmap:
@@ -45,6 +77,97 @@ class ElasticDocument:
             cnv = next(ii, 'noconversion')
             fcnv = cnv if callable(cnv) else getconverter(cnv)
             self.docmap.append((dname, ename, fcnv))
+        self.compile()
+        return
+
+
+    def compile(self):
+        """Generate specialized conversion functions for current `docmap`.
+        """
+        self._patterns = [_parsepattern(dname) for dname, _, _ in self.docmap]
+        self._plans = {}
+        if any(self._patterns):
+            self._convert = self._convertplanned
+            self._convertmany = self._convertmanyplanned
+            return
+        entries = [(_parsepath(dname), ename, fcnv)
+                   for dname, ename, fcnv in self.docmap]
+        self._convert = _compiledocmap(entries)
+        self._convertmany = _compiledocmap(entries, many=True)
+        return
+
+
+    def _plan(self, keys):
+        """Return conversion functions for documents with given keys.
+
+        Resolve the pattern entries of `docmap` to matching `keys`
+        and compile the result.  The functions are cached per `keys`.
+
+        Parameters
+        ----------
+        keys : tuple
+            The keys of input document in their order.
+
+        Returns
+        -------
+        tuple
+            The pair of functions for converting one document and
+            a batch of documents.
+        """
+        rv = self._plans.get(keys)
+        if rv is not None:
+            return rv
+        entries = []
+        for (dname, ename, fcnv), rx in zip(self.docmap, self._patterns):
+            if rx is None:
+                entries.append((_parsepath(dname), ename, fcnv))
+                continue
+            for k in keys:
+                mx = rx.fullmatch(k) if isinstance(k, str) else None
+                if mx is None:
+                    continue
+                kout = k if ename == dname else mx.expand(ename)
+                entries.append(((k,), kout, fcnv))
+        rv = (_compiledocmap(entries), _compiledocmap(entries, many=True))
+        if len(self._plans) >= self.maxplans:
+            self._plans.clear()
+        self._plans[keys] = rv
+        return rv
+
+
+    def _convertplanned(self, entry):
+        "Convert one document using the plan for its keys."
+        rv = self._plan(tuple(entry))[0](entry)
+        return rv
+
+
+    def _convertmanyplanned(self, entries):
+        "Convert batch of documents grouped by their key layout."
+        entries = list(entries)
+        groups = collections.defaultdict(list)
+        for i, e in enumerate(entries):
+            groups[tuple(e)].append(i)
+        rv = [None] * len(entries)
+        for keys, indices in groups.items():
+            convertmany = self._plan(keys)[1]
+            docs = convertmany([entries[i] for i in indices])
+            for i, doc in zip(indices, docs):
+                rv[i] = doc
+        return rv
+
+
+    def __getstate__(self):
+        "Return picklable state without the generated functions."
+        state = self.__dict__.copy()
+        for name in ('_convert', '_convertmany', '_patterns', '_plans'):
+            state.pop(name, None)
+        return state
+
+
+    def __setstate__(self, state):
+        "Restore state and regenerate the conversion functions."
+        self.__dict__.update(state)
+        self.compile()
         return
 
 
@@ -62,15 +185,227 @@ class ElasticDocument:
         dict
             The transformed document in a new dictionary object.
         """
-        rv = {}
-        for dname, ename, fcnv in self.docmap:
-            if dname not in entry:
+        rv = self._convert(entry)
+        return rv
+
+
+    def esproperties(self):
+        """Derive Elasticsearch mapping of output fields from converters.
+
+        The field types are obtained with `converters.getesproperty`.
+        Dictionary-valued fields with typed items and pattern entries
+        with `keyout` inside a fixed object such as ``"offset.\\1"``
+        are mapped as dynamic objects with dynamic templates for their
+        items.
+
+        Returns
+        -------
+        properties : dict
+            The mapping properties of typed output fields.
+        templates : list
+            The dynamic templates for fields inside dynamic objects.
+        untyped : set
+            The `keyout` of entries or patterns with unknown type of
+            output, which require dynamic mapping.
+        """
+        properties = {}
+        templates = []
+        untyped = set()
+
+        def addobject(name, items):
+            properties.setdefault(name, {"type": "object", "dynamic": True})
+            templates.append({name + "_items": {
+                "path_match": name + ".*", "mapping": items}})
+            return
+
+        for (dname, ename, fcnv), rx in zip(self.docmap, self._patterns):
+            if ename == '_id':
                 continue
-            dvalue = entry[dname]
-            evalue = fcnv(dvalue) if dvalue is not None else None
-            if evalue is None:
+            prop, items = getesproperty(fcnv)
+            if rx is not None:
+                head = '' if ename == dname else ename.split('\\')[0]
+                if prop is None or '.' not in head:
+                    untyped.add(ename)
+                    continue
+                addobject(head.rsplit('.', 1)[0], prop)
                 continue
-            rv[ename] = evalue
+            if prop is None:
+                untyped.add(ename)
+                continue
+            properties.setdefault(ename, prop)
+            if items is not None:
+                addobject(ename, items)
+        return properties, templates, untyped
+
+
+    def map_many(self, entries):
+        """Convert a batch of dictionary documents.
+
+        This is equivalent to ``list(map(self, entries))``, but faster
+        for large batches.  Converters with a batch implementation,
+        see `converters.register_batch`, are applied to all values of
+        their input key at once.
+
+        Parameters
+        ----------
+        entries : iterable
+            The input dictionary documents.
+
+        Returns
+        -------
+        list of dict
+            The transformed documents in new dictionary objects.
+        """
+        rv = self._convertmany(entries)
         return rv
 
 # end of class
+
+
+def _compiledocmap(entries, many=False):
+    """Generate Python function that converts documents per docmap.
+
+    Each input key is looked up once with ``entry.get``, which treats
+    missing keys the same as keys with ``None`` value.  Dotted paths
+    are resolved by a chain of lookups which gives None when some
+    intermediate item is missing or of a wrong type.  The shared path
+    prefixes are resolved only once.  The converters other than
+    `noconversion` are referenced as default arguments.
+
+    Parameters
+    ----------
+    entries : list of tuples
+        The expanded docmap of ``(path, keyout, converter)`` tuples,
+        where `path` is a tuple of keys and list indices.
+    many : bool, optional
+        When True, generate function which converts a batch of documents
+        and applies batch converters to the collected input values.
+        Batch converters are used only for output keys that are not
+        shared with other docmap entries.
+
+    Returns
+    -------
+    function
+        The conversion function that takes one input dictionary or
+        an iterable of input dictionaries when `many` is True.
+    """
+    converters = {}
+    lookups = {}
+    lines = []
+    columns = []
+    enamecount = collections.Counter(ename for _, ename, _ in entries)
+    for path, ename, fcnv in entries:
+        v = _accessor(path, lookups, lines)
+        lines.append('if {} is not None:'.format(v))
+        if fcnv is noconversion:
+            lines.append('    rv[{!r}] = {}'.format(ename, v))
+            continue
+        fbatch = getbatchconverter(fcnv) if many else None
+        if fbatch is not None and enamecount[ename] == 1:
+            b = 'b{}'.format(len(columns))
+            converters[b] = fbatch
+            columns.append((b, ename))
+            lines += ['    {}col.append({})'.format(b, v),
+                      '    {}out.append(rv)'.format(b)]
+            continue
+        c = 'c{}'.format(id(fcnv))
+        converters[c] = fcnv
+        lines += ['    e = {}({})'.format(c, v),
+                  '    if e is not None:',
+                  '        rv[{!r}] = e'.format(ename)]
+    args = ''.join(', {}={}'.format(c, c) for c in converters)
+    if not many:
+        source = ['def convert(entry{}):'.format(args),
+                  '    rv = {}',
+                  '    get = entry.get']
+        source += ['    ' + ln for ln in lines]
+        source += ['    return rv']
+    else:
+        source = ['def convert(entries{}):'.format(args),
+                  '    output = []',
+                  '    append = output.append']
+        for b, ename in columns:
+            source += ['    {}col = []'.format(b),
+                       '    {}out = []'.format(b)]
+        source += ['    for entry in entries:',
+                   '        rv = {}',
+                   '        get = entry.get']
+        source += ['        ' + ln for ln in lines]
+        source += ['        append(rv)']
+        for b, ename in columns:
+            source += [
+                '    for rv, e in zip({0}out, {0}({0}col)):'.format(b),
+                '        if e is not None:',
+                '            rv[{!r}] = e'.format(ename)]
+        source += ['    return output']
+    namespace = dict(converters)
+    exec('\n'.join(source), namespace)
+    rv = namespace['convert']
+    return rv
+
+
+def _accessor(path, lookups, lines):
+    """Generate code for reading value at `path` and return its variable.
+
+    Parameters
+    ----------
+    path : tuple
+        The sequence of dictionary keys and list indices.
+    lookups : dict
+        The variable names of already resolved path prefixes.
+    lines : list
+        The lines of generated code to be extended.
+
+    Returns
+    -------
+    str
+        The name of variable with the value at `path` or None.
+    """
+    for n in range(1, len(path) + 1):
+        prefix = path[:n]
+        if prefix in lookups:
+            continue
+        v = lookups[prefix] = 'v{}'.format(len(lookups))
+        if n == 1:
+            lines.append('{} = get({!r})'.format(v, path[0]))
+            continue
+        u = lookups[path[:n - 1]]
+        k = path[n - 1]
+        if isinstance(k, str):
+            code = '{v} = {u}.get({k!r}) if isinstance({u}, dict) else None'
+            lines.append(code.format(v=v, u=u, k=k))
+            continue
+        m = k if k >= 0 else -k - 1
+        code = ('{v} = {u}[{k}] if isinstance({u}, (list, tuple)) '
+                'and len({u}) > {m} else None')
+        lines.append(code.format(v=v, u=u, k=k, m=m))
+    return lookups[path]
+
+
+def _parsepattern(dname):
+    """Return compiled regular expression for pattern source name.
+
+    Return None if `dname` is not a glob or regular expression pattern.
+    """
+    if not isinstance(dname, str):
+        return None
+    if len(dname) > 2 and dname.startswith('/') and dname.endswith('/'):
+        return re.compile(dname[1:-1])
+    if '*' in dname or '?' in dname:
+        return re.compile(fnmatch.translate(dname))
+    return None
+
+
+def _parsepath(dname):
+    """Split dotted path with list indices to a tuple of keys and indices.
+
+    Return one-item tuple of `dname` if it is not a valid path.
+    """
+    if not isinstance(dname, str) or not _rxpath.fullmatch(dname):
+        return (dname,)
+    rv = tuple(int(i) if i else k
+               for k, i in _rxpathitem.findall(dname))
+    return rv
+
+_rxpath = re.compile(r'[^.\[\]]+(\.[^.\[\]]+|\[-?\d+\])*')
+_rxpathitem = re.compile(r'([^.\[\]]+)|\[(-?\d+)\]')
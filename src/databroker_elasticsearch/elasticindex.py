@@ -4,12 +4,218 @@
 Class for convenient access to Elasticsearch index.
 """
 
+import collections
+import contextlib
+import copy
+import hashlib
+import itertools
+import json
+import re
+import time
 from typing import Callable
 from elasticsearch import Elasticsearch
 from elasticsearch import helpers as eshelpers
 
 
-class ElasticIndex:
+class ElasticIndexBase:
+    """Index settings and conversion of documents to Elasticsearch entries.
+
+    This class holds the parts of `ElasticIndex` that do not
+    communicate with Elasticsearch and are shared with the asyncio
+    `AsyncElasticIndex`.  The `es` client is stored as is.
+
+    See Also
+    --------
+    ElasticIndex : description of the arguments and attributes.
+    """
+
+    def __init__(self, es, index, mapper=None, criteria=None,
+                 hashfield=None):
+        self.es = es
+        self.index = index
+        self.mapper = mapper
+        self.criteria = criteria
+        self.hashfield = hashfield
+        self.doc_type = "run_start"
+        self.doc_properties = {
+            "time": {"type": "date", "format": "epoch_second"},
+            "date": {"type": "date",
+                     "format": "strict_date_optional_time||epoch_second"},
+        }
+        if hashfield:
+            self.doc_properties[hashfield] = {"type": "keyword",
+                                              "index": False}
+        self.doc_dynamic = True
+        self.doc_templates = []
+        self._verified_index = ''
+        return
+
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a new index instance using a configuration dictionary.
+
+        Parameters
+        ----------
+        config : dict
+            The configuration dictionary that describes ElasticIndex.
+            It must contain "databroker-elasticsearch" key.
+            The optional "hashfield" item sets the `hashfield` attribute.
+
+        Returns
+        -------
+        ElasticIndexBase
+            The instance of this class with `doc_properties` derived
+            from the docmap converters.  The `doc_dynamic` is "strict"
+            if all output fields have known type.
+        """
+        from databroker_elasticsearch.elasticdocument import ElasticDocument
+        cfg = config['databroker-elasticsearch']
+        esdoc = ElasticDocument(cfg['docmap'])
+        rv = cls(es=cfg['host'], index=cfg['index'], mapper=esdoc,
+                 hashfield=cfg.get('hashfield'))
+        properties, templates, untyped = esdoc.esproperties()
+        properties.update(rv.doc_properties)
+        rv.doc_properties = properties
+        rv.doc_templates = templates
+        if not untyped.difference(properties):
+            rv.doc_dynamic = "strict"
+        return rv
+
+
+    def _generate(self, docs, batchsize=500, placeholders=False,
+                  progress=None):
+        """Produce transformed Elasticsearch entries that pass the criteria.
+
+        The transformed documents must have an `_id` key which is then used
+        for Elasticsearch unique identifier.  The `_id` is popped directly
+        from the output of a `mapper` with a true `newdict` attribute,
+        other documents are copied first to keep the input intact.
+        When `hashfield` is set, add content hash of each entry.
+        A `mapper` with the `map_many` method is applied to batches
+        of `batchsize` documents.
+
+        Parameters
+        ----------
+        docs : iterable
+            The sequence of input documents of dictionary type.
+        batchsize : int, optional
+            The number of documents converted at once by `map_many`.
+        placeholders : bool, optional
+            When True, produce None for documents rejected by `criteria`
+            so that the output items match input documents one to one.
+        progress : Progress, optional
+            The `Progress` object to be updated with counts of read
+            and mapped documents when a batch conversion is complete.
+
+        Yield
+        -----
+        tuple
+            The pairs of (_id, _source) for ES entry identifier and body.
+        """
+        if not placeholders and not progress:
+            okdocs = (docs if self.criteria is None
+                      else filter(self.criteria, docs))
+            yield from self._convert(okdocs, batchsize)
+            return
+        for batch in _batches(docs, batchsize):
+            oks = ([True] * len(batch) if self.criteria is None
+                   else list(map(self.criteria, batch)))
+            entries = list(self._convert(itertools.compress(batch, oks),
+                                         batchsize))
+            if progress:
+                progress.read += len(batch)
+                progress.mapped += len(entries)
+            if not placeholders:
+                yield from entries
+                continue
+            ientries = iter(entries)
+            for ok in oks:
+                yield next(ientries) if ok else None
+        pass
+
+
+    def _convert(self, docs, batchsize):
+        "Apply `mapper` and `hashfield` to documents that pass criteria."
+        mapmany = getattr(self.mapper, 'map_many', None)
+        if self.mapper is None:
+            entries = docs
+        elif mapmany is not None:
+            entries = itertools.chain.from_iterable(
+                map(mapmany, _batches(docs, batchsize)))
+        else:
+            entries = map(self.mapper, docs)
+        owned = getattr(self.mapper, 'newdict', False)
+        hashfield = self.hashfield
+        for e in entries:
+            doc = e if owned else e.copy()
+            i = doc.pop('_id')
+            if hashfield:
+                doc[hashfield] = contenthash(doc)
+            yield (i, doc)
+        pass
+
+
+    def entryid(self, doc):
+        """Return ES identifier of the entry converted from a document.
+
+        The `criteria` are not applied.  The `mapper` may receive
+        a partial document such as one with only the "uid" field.
+
+        Parameters
+        ----------
+        doc : dict
+            The input document.
+
+        Returns
+        -------
+        str or None
+            The `_id` of the converted entry or None when `mapper`
+            produced no `_id` for this document.
+        """
+        e = doc if self.mapper is None else self.mapper(doc)
+        i = e.get('_id')
+        return None if i is None else str(i)
+
+
+    def _mappingbody(self):
+        "Return the mapping definition of `doc_type` for `reset`."
+        rv = {"dynamic": self.doc_dynamic,
+              "properties": self.doc_properties}
+        if self.doc_templates:
+            rv["dynamic_templates"] = self.doc_templates
+        return rv
+
+
+    def _search_arguments(self, q, kwargs):
+        """Return keyword arguments for the `Elasticsearch.search` call.
+
+        Raises
+        ------
+        TypeError
+            When `kwargs` clash with the `q` or `index` arguments or
+            contain both ``body`` and ``query``.
+        """
+        kw = dict(q=q, index=self.index)
+        clashing_args = set(kw).intersection(kwargs)
+        bq = set(('body', 'query'))
+        if bq.issubset(kwargs):
+            clashing_args.update(bq)
+        if clashing_args:
+            emsg = ("Conficting keyword arguments: " +
+                    ', '.join(clashing_args))
+            raise TypeError(emsg)
+        kwargs = dict(kwargs)
+        if 'query' in kwargs:
+            kw['body'] = kwargs.pop('query')
+        kw.update(kwargs)
+        return kw
+
+# end of class
+
+
+class ElasticIndex(ElasticIndexBase):
     """Convenience functions for adding documents to Elasticsearch index.
 
     Parameters
@@ -22,10 +228,15 @@ class ElasticIndex:
         The index to use in Elasticsearch
     mapper : callable, optional
         A function to transform input document to Elasticsearch entry.
+        When the mapper has a true `newdict` attribute, it must return
+        a new dictionary which is then modified without making a copy.
     criteria : callable, optional
         Callable which is run on all the start document, if the return is
         truthy the document is sent to ES else, it is not added. Defaults
         to True for all documents
+    hashfield : str, optional
+        The name of ES field for storing content hash of the entry.
+        No hash is stored when not specified.
 
     Attributes
     ----------
@@ -40,11 +251,19 @@ class ElasticIndex:
         Callable which is run on the added document.  If the return
         is True the document is sent to the ES and is ignored otherwise.
         The default is True for all documents.
+    hashfield : str or None
+        The name of ES field with a stable hash of the entry content,
+        which allows to skip unchanged entries in `devour`.
     doc_type : str
         The name of Elasticsearch document type for added entries.
         The default is "run_start".
     doc_properties : dict
         The field names and data types in the Elasticsearch `doc_type`. [1]_
+    doc_dynamic : bool or str
+        The dynamic mapping mode of `doc_type` for fields not present
+        in `doc_properties`.  Use "strict" to reject such entries.
+    doc_templates : list
+        The dynamic templates for mapping new fields in `doc_type`.
 
     References
     ----------
@@ -57,72 +276,77 @@ class ElasticIndex:
             index: str,
             mapper: Callable=None,
             criteria: Callable=None,
+            hashfield: str=None,
     ):
-        self.es = (Elasticsearch(es) if isinstance(es, str)
-                   else Elasticsearch(**es) if isinstance(es, dict)
-                   else es)
-        self.index = index
-        self.mapper = mapper
-        self.criteria = criteria
-        self.doc_type = "run_start"
-        self.doc_properties = {
-            "time": {"type": "date", "format": "epoch_second"},
-            "date": {"type": "date",
-                     "format": "strict_date_optional_time||epoch_second"},
-        }
-        self._verified_index = ''
+        es = (Elasticsearch(es) if isinstance(es, str)
+              else Elasticsearch(**es) if isinstance(es, dict)
+              else es)
+        super().__init__(es, index, mapper=mapper, criteria=criteria,
+                         hashfield=hashfield)
         return
 
 
-    @classmethod
-    def from_config(cls, config):
-        """
-        Create a new ElasticIndex instance using a configuration dictionary.
-
-        Parameters
-        ----------
-        config : dict
-            The configuration dictionary that describes ElasticIndex.
-            It must contain "databroker-elasticsearch" key.
-
-        Returns
-        -------
-        ElasticIndex
-        """
-        from databroker_elasticsearch.elasticdocument import ElasticDocument
-        cfg = config['databroker-elasticsearch']
-        esdoc = ElasticDocument(cfg['docmap'])
-        rv = cls(es=cfg['host'], index=cfg['index'], mapper=esdoc)
-        return rv
-
-
-    def _generate(self, docs):
-        """Produce transformed Elasticsearch entries that pass the criteria.
+    def _changedentries(self, entries, unchanged, batchsize=1000,
+                        placeholders=False):
+        """Filter out entries with the same content hash as stored in ES.
 
-        The transformed documents must have an `_id` key which is then used
-        for Elasticsearch unique identifier.
+        The stored hashes are retrieved with one `mget` request per
+        `batchsize` entries.
 
         Parameters
         ----------
-        docs : iterable
-            The sequence of input documents of dictionary type.
+        entries : iterable
+            The (_id, _source) pairs with content hash in `hashfield`.
+            None items are passed through.
+        unchanged : list
+            The one-item list with counter of skipped entries.
+        placeholders : bool, optional
+            When True, produce None in place of the skipped entries.
 
         Yield
         -----
         tuple
-            The pairs of (_id, _source) for ES entry identifier and body.
+            The pairs of (_id, _source) for new or modified entries.
         """
-        okdocs = (docs if self.criteria is None
-                  else filter(self.criteria, docs))
-        entries = (okdocs if self.mapper is None
-                   else map(self.mapper, okdocs))
-        for e in entries:
-            doc = e.copy()
-            i = doc.pop('_id')
-            yield (i, doc)
+        hf = self.hashfield
+        ii = iter(entries)
+        batch = list(itertools.islice(ii, batchsize))
+        while batch:
+            ids = [e[0] for e in batch if e is not None]
+            stored = {}
+            if ids:
+                res = self.es.mget(index=self.index, doc_type=self.doc_type,
+                                   body={"ids": ids}, _source=[hf])
+                stored = {d['_id']: d['_source'].get(hf)
+                          for d in res['docs'] if d.get('found')}
+            for e in batch:
+                if e is not None and stored.get(str(e[0])) == e[1][hf]:
+                    unchanged[0] += 1
+                    e = None
+                if e is not None or placeholders:
+                    yield e
+            batch = list(itertools.islice(ii, batchsize))
         pass
 
 
+    def _bulkheader(self, op_type='index'):
+        """Return function which expands entry to bulk action and source.
+
+        The function is used as `expand_action_callback` for the bulk
+        helpers.  It takes a pair of (_id, body) and returns serialized
+        action line and the body, so that no intermediate action
+        dictionaries are created.
+        """
+        prefix = '{{"{}":{{"_index":{},"_type":{},"_id":'.format(
+            op_type, json.dumps(self.index), json.dumps(self.doc_type))
+
+        def expand(entry):
+            i, body = entry
+            return prefix + json.dumps(i, default=str) + '}}', body
+
+        return expand
+
+
     def _ensure_index_exists(self):
         """Create and reset the index if it does not exist yet.
         """
@@ -141,13 +365,128 @@ class ElasticIndex:
         """Remove all data from the `index` and set it up anew.
 
         Set up mappings for the Elasticsearch `doc_type` according to
-        `doc_properties`.
+        `doc_properties`, `doc_dynamic` and `doc_templates`.
+        When `index` is an alias set by `publish`, delete the indices
+        it points to and replace the alias with a regular index.
         """
-        self.es.indices.delete(index=self.index, ignore_unavailable=True)
+        if self.es.indices.exists_alias(name=self.index):
+            current = self.es.indices.get_alias(name=self.index)
+            self.es.indices.delete(index=','.join(current))
+        else:
+            self.es.indices.delete(index=self.index, ignore_unavailable=True)
         self.es.indices.create(index=self.index)
-        mbody = {"properties": self.doc_properties}
         self.es.indices.put_mapping(
-            doc_type=self.doc_type, index=self.index, body=mbody)
+            doc_type=self.doc_type, index=self.index,
+            body=self._mappingbody())
+        return
+
+
+    @contextlib.contextmanager
+    def bulkload(self, forcemerge=False):
+        """Context manager with index settings for fast bulk loading.
+
+        Disable index refresh and replicas for the duration of the
+        context.  On exit restore the original settings, refresh the
+        index once and optionally merge its segments.  An index with
+        disabled refresh is assumed to be left over from interrupted
+        bulk loading and its refresh and replicas are restored to
+        the Elasticsearch defaults.
+
+        Parameters
+        ----------
+        forcemerge : bool, optional
+            When True, force-merge the index to one segment on exit.
+        """
+        self._ensure_index_exists()
+        keys = ('refresh_interval', 'number_of_replicas')
+        res = self.es.indices.get_settings(
+            index=self.index, name=','.join('index.' + k for k in keys))
+        # unset values are restored to defaults with None
+        original = {nm: {k: info['settings']['index'].get(k) for k in keys}
+                    for nm, info in res.items()}
+        for values in original.values():
+            if values['refresh_interval'] == '-1':
+                values.update(dict.fromkeys(keys))
+        loadsettings = {"refresh_interval": "-1", "number_of_replicas": 0}
+        self.es.indices.put_settings(index=self.index,
+                                     body={"index": loadsettings})
+        try:
+            yield self
+        finally:
+            for nm, values in original.items():
+                self.es.indices.put_settings(index=nm,
+                                             body={"index": values})
+            self.es.indices.refresh(index=self.index)
+            if forcemerge:
+                self.es.indices.forcemerge(index=self.index,
+                                           max_num_segments=1)
+        pass
+
+
+    def versions(self):
+        """Return version numbers of the versioned indices of `index`.
+
+        The versioned indices are named ``<index>-v<N>`` and are created
+        by `nextversion`.
+
+        Returns
+        -------
+        list of int
+            The sorted version numbers of existing indices.
+        """
+        res = self.es.indices.get(index=self.index + '-v*')
+        pattern = re.compile(re.escape(self.index) + r'-v(\d+)$')
+        mxs = (pattern.match(name) for name in res)
+        rv = sorted(int(mx.group(1)) for mx in mxs if mx)
+        return rv
+
+
+    def nextversion(self):
+        """Set up empty index for the next version of `index`.
+
+        Returns
+        -------
+        ElasticIndex
+            The copy of this object which writes to a new index
+            ``<index>-v<N>`` with the same `mapper` and `criteria`.
+        """
+        n = max(self.versions(), default=0) + 1
+        rv = copy.copy(self)
+        rv.index = '{}-v{}'.format(self.index, n)
+        rv._verified_index = ''
+        rv.reset()
+        return rv
+
+
+    def publish(self, target, keep=2):
+        """Atomically point the `index` alias to the `target` index.
+
+        A regular index named `index` is replaced with the alias in the
+        same atomic operation.  Afterwards delete old versioned indices
+        so that only `keep` most recent versions remain.
+
+        Parameters
+        ----------
+        target : str
+            The name of the versioned index with complete content.
+        keep : int, optional
+            The number of versioned indices to retain, including `target`.
+        """
+        self.es.indices.refresh(index=target)
+        actions = []
+        if self.es.indices.exists_alias(name=self.index):
+            current = self.es.indices.get_alias(name=self.index)
+            actions.extend({"remove": {"index": i, "alias": self.index}}
+                           for i in current)
+        elif self.es.indices.exists(self.index):
+            actions.append({"remove_index": {"index": self.index}})
+        actions.append({"add": {"index": target, "alias": self.index}})
+        self.es.indices.update_aliases(body={"actions": actions})
+        self._verified_index = ''
+        vnames = ['{}-v{}'.format(self.index, v) for v in self.versions()]
+        stale = [nm for nm in vnames[:-max(keep, 1)] if nm != target]
+        if stale:
+            self.es.indices.delete(index=','.join(stale))
         return
 
 
@@ -171,22 +510,78 @@ class ElasticIndex:
         dict
             The Elasticsearch response with matching hits.
         """
-        kw = dict(q=q, index=self.index)
-        clashing_args = set(kw).intersection(kwargs)
-        bq = set(('body', 'query'))
-        if bq.issubset(kwargs):
-            clashing_args.update(bq)
-        if clashing_args:
-            emsg = ("Conficting keyword arguments: " +
-                    ', '.join(clashing_args))
-            raise TypeError(emsg)
-        if 'query' in kwargs:
-            kw['body'] = kwargs.pop('query')
-        kw.update(kwargs)
+        kw = self._search_arguments(q, kwargs)
         rv = self.es.search(**kw)
         return rv
 
 
+    def maxtime(self, field='time'):
+        """Return the latest time value stored in the index.
+
+        This uses a single `max` aggregation over the whole index.
+
+        Parameters
+        ----------
+        field : str, optional
+            The name of ES field with the time of the entries.
+
+        Returns
+        -------
+        float or None
+            The maximum of `field` in seconds since POSIX epoch
+            or None when the index does not exist or has no values.
+        """
+        if not self.es.indices.exists(self.index):
+            return None
+        body = {"size": 0, "aggs": {"maxtime": {"max": {"field": field}}}}
+        res = self.es.search(index=self.index, body=body)
+        rv = res['aggregations']['maxtime']['value']
+        # ES aggregates date fields in epoch milliseconds
+        isdate = self.doc_properties.get(field, {}).get('type') == 'date'
+        if rv is not None and isdate:
+            rv /= 1000.0
+        return rv
+
+
+    def scanids(self):
+        """Iterate over identifiers of all entries in index.
+
+        The entries are retrieved with a scroll query which returns
+        no source fields.
+
+        Yield
+        -----
+        str
+            The `_id` of every ES entry.
+        """
+        if not self.es.indices.exists(self.index):
+            return
+        gscan = eshelpers.scan(self.es, index=self.index,
+                               _source=False, size=5000)
+        for e in gscan:
+            yield e['_id']
+        pass
+
+
+    def remove(self, ids):
+        """Delete entries with the specified identifiers in bulk.
+
+        Parameters
+        ----------
+        ids : iterable
+            The `_id` values of the entries to be deleted.
+
+        Returns
+        -------
+        int
+            Number of deleted entries.
+        """
+        actions = ((i, None) for i in ids)
+        res = eshelpers.bulk(self.es, actions, raise_on_error=False,
+                             expand_action_callback=self._bulkheader('delete'))
+        return res[0]
+
+
     def ingest(self, doc):
         """Convert and insert one document to ES if it passes `criteria`.
 
@@ -206,21 +601,471 @@ class ElasticIndex:
         return cnt
 
 
-    def devour(self, docs):
+    def devour(self, docs, processes=1, skipunchanged=False, progress=None,
+               onresult=None, **kwargs):
         """Convert and add many documents to ES if they pass `criteria`.
 
         When `index` does not exist, call `reset` to set it up.
 
+        Parameters
+        ----------
+        docs : iterable
+            The input documents of dictionary type.
+        processes : int, optional
+            The number of worker processes which apply `criteria` and
+            `mapper` to the documents.  The converted entries are sent
+            in the original order.  When larger than one, `criteria`
+            and `mapper` must be picklable.
+        skipunchanged : bool, optional
+            When True, do not send entries which have the same content
+            hash as the entries stored in ES.  Requires `hashfield`.
+        progress : Progress or bool, optional
+            The `Progress` object to be updated with counts of read,
+            mapped and sent documents.  When True, create a `Progress`
+            with the total set to the length of `docs` if available
+            and make its final report on completion.
+        onresult : callable, optional
+            The function called as ``onresult(position, ok)`` when the
+            document at 0-based `position` in `docs` is processed.
+            The `ok` is True or False for acknowledged or failed entries
+            and None for documents rejected by `criteria` or skipped as
+            unchanged.  The calls are not ordered by position.
+        kwargs : misc, optional
+            Bulk options passed to the `upload` method.
+
         Returns
         -------
-        int
-            Number of added documents.
+        int or BulkStats
+            Number of added documents or the `BulkStats` summary
+            when called with ``stats=True``.
+
+        Raises
+        ------
+        ValueError
+            When `skipunchanged` is used without `hashfield`.
         """
+        owned = progress is True
+        if owned:
+            from databroker_elasticsearch.progress import Progress
+            total = len(docs) if hasattr(docs, '__len__') else None
+            progress = Progress(total=total)
+        placed = onresult is not None
+        if processes > 1:
+            entries = self._mpgenerate(docs, processes, progress=progress,
+                                       placeholders=placed)
+        else:
+            entries = self._generate(docs, placeholders=placed,
+                                     progress=progress)
+        unchanged = [0]
+        if skipunchanged:
+            if not self.hashfield:
+                raise ValueError("skipunchanged requires hashfield.")
+            entries = self._changedentries(entries, unchanged,
+                                           placeholders=placed)
+        rv = self.upload(entries, progress=progress, onresult=onresult,
+                         **kwargs)
+        if kwargs.get('stats'):
+            rv.unchanged += unchanged[0]
+        if owned:
+            progress.done()
+        return rv
+
+
+    def _mpgenerate(self, docs, processes, batchsize=200, progress=None,
+                    placeholders=False):
+        """Produce transformed entries using a pool of worker processes.
+
+        The documents are converted in batches of `batchsize` with at
+        most two pending batches per process, so that memory use is
+        bounded for arbitrarily long input.  The `read` and `mapped`
+        counts of `progress` are increased when a batch conversion
+        is complete.
+        See `_generate` for the `placeholders` argument.
+
+        Yield
+        -----
+        tuple
+            The pairs of (_id, _source) in the order of input documents.
+        """
+        import multiprocessing
+        pending = collections.deque()
+        maxpending = 2 * processes
+        initargs = (self.criteria, self.mapper, self.hashfield)
+        with multiprocessing.Pool(processes, _initworker, initargs) as pool:
+            ii = iter(docs)
+            batch = list(itertools.islice(ii, batchsize))
+            while batch:
+                res = pool.apply_async(_convertbatch, (batch, placeholders))
+                pending.append((len(batch), res))
+                if len(pending) >= maxpending:
+                    yield from _batchresult(pending.popleft(), progress)
+                batch = list(itertools.islice(ii, batchsize))
+            while pending:
+                yield from _batchresult(pending.popleft(), progress)
+        pass
+
+
+    def upload(self, entries, threads=1, chunk_size=500, queue_size=4,
+               max_retries=3, initial_backoff=2, max_backoff=600,
+               target_latency=None, stats=False, progress=None,
+               onresult=None, op_type='index'):
+        """Add already converted entries to ES in bulk.
+
+        When `index` does not exist, call `reset` to set it up.
+        The bulk responses are processed item by item.  Items rejected
+        by busy Elasticsearch with HTTP status 429 are sent again after
+        exponentially growing delay before the next chunk is sent,
+        other items are not resent.
+
+        Parameters
+        ----------
+        entries : iterable
+            The sequence of (_id, _source) pairs for ES entry identifier
+            and body as produced by `_generate`.
+        threads : int, optional
+            The number of threads that send bulk requests in parallel.
+        chunk_size : int, optional
+            The number of entries sent in one bulk request.
+            This is the initial value when `target_latency` is used.
+        queue_size : int, optional
+            The number of chunks prepared ahead for parallel threads.
+        max_retries : int, optional
+            The maximum number of attempts to resend rejected entries
+            of one chunk.
+        initial_backoff : float, optional
+            The delay in seconds before the first retry.  The delay
+            doubles for every subsequent retry.
+        max_backoff : float, optional
+            The maximum delay in seconds between retries.
+        target_latency : float, optional
+            When specified, tune the number of entries and bytes in one
+            bulk request at runtime so that it takes about `target_latency`
+            seconds.  Only used with one thread.
+        stats : bool, optional
+            When True, return `BulkStats` summary instead of count.
+        progress : Progress, optional
+            The `Progress` object to be updated with counts of sent,
+            acknowledged and failed entries and of sent bytes.
+        onresult : callable, optional
+            The function called as ``onresult(position, ok)`` with the
+            0-based position in `entries` and the success flag of every
+            entry after it was acknowledged or failed without retry.
+            None items of `entries` are not sent and they are reported
+            with ``ok=None``.
+        op_type : str, optional
+            The bulk operation, either "index" to add or replace entries
+            or "create" to add only new entries.  For "create" the entries
+            which already exist in ES are counted as `unchanged` and
+            reported to `onresult` with ``ok=None``.
+
+        Returns
+        -------
+        int or BulkStats
+            Number of added entries or the `BulkStats` summary
+            of added, retried and failed entries.
+
+        Raises
+        ------
+        elasticsearch.helpers.BulkIndexError
+            When some entries failed and `stats` is False.
+        """
+        from databroker_elasticsearch.bulkstats import BulkStats, isconflict
+        if op_type not in ('index', 'create'):
+            raise ValueError("Invalid bulk operation {!r}.".format(op_type))
         self._ensure_index_exists()
-        a = {"_index": self.index, "_type": self.doc_type}
-        actions = ((a, a.update(_id=i, _source=src))[0]
-                   for i, src in self._generate(docs))
-        res = eshelpers.bulk(self.es, actions)
-        return res[0]
+        positions = collections.deque()
+        actions = _positioned(enumerate(entries), positions, onresult)
+        retry = (max_retries, initial_backoff, max_backoff)
+        bst = BulkStats()
+        tuner = None
+        if target_latency is not None and threads <= 1:
+            from databroker_elasticsearch.chunktuner import ChunkTuner
+            tuner = ChunkTuner(self.es.transport.serializer,
+                               target_latency, chunk_size=chunk_size)
+        results = (self._tunedresults(actions, tuner, retry, progress,
+                                      op_type) if tuner else
+                   self._bulkresults(actions, threads, chunk_size,
+                                     queue_size, retry, progress, op_type))
+        for resent, ok, item in results:
+            pos = positions.popleft()
+            bst.retried += resent
+            if progress:
+                progress.sent += resent
+            if not ok and op_type == 'create' and isconflict(item):
+                bst.unchanged += 1
+                if onresult is not None:
+                    onresult(pos, None)
+                continue
+            bst.add(ok, item)
+            if onresult is not None:
+                onresult(pos, ok)
+            if progress:
+                progress.acked += ok
+                progress.failed += not ok
+                progress.update()
+        bst.chunk_size = chunk_size if tuner is None else tuner.chunk_size
+        bst.chunk_bytes = None if tuner is None else tuner.chunk_bytes
+        if bst.failed and not stats:
+            emsg = "{} document(s) failed to index.".format(bst.failed)
+            raise eshelpers.BulkIndexError(emsg, bst.failures)
+        rv = bst if stats else bst.indexed
+        return rv
+
+
+    def _bulkresults(self, actions, threads, chunk_size, queue_size,
+                     retry, progress=None, op_type='index'):
+        """Send bulk actions in chunks and produce their item results.
+
+        Parameters
+        ----------
+        actions : iterable
+            The (_id, _source) pairs to be indexed.
+        retry : tuple
+            The `max_retries`, `initial_backoff` and `max_backoff`
+            arguments of `upload`.
+        progress : Progress, optional
+            The progress to be updated with counts of sent entries and
+            bytes.  The sources are then serialized here so that their
+            size is known.
+
+        Yield
+        -----
+        tuple
+            The triplets of (resent, ok, item) with the number of times
+            the action was resent, its success flag and the Elasticsearch
+            item response in the order of `actions`.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def measured(actions):
+            dumps = self.es.transport.serializer.dumps
+            for i, src in actions:
+                if not isinstance(src, (str, bytes)):
+                    src = dumps(src)
+                progress.sent += 1
+                progress.bytes += len(src)
+                yield (i, src)
+            pass
+
+        if progress:
+            actions = measured(actions)
+        expand = self._bulkheader(op_type)
+        chunks = _batches(actions, chunk_size)
+        if threads <= 1:
+            for chunk in chunks:
+                yield from self._sendchunk(chunk, expand, retry)
+            return
+        pending = collections.deque()
+        with ThreadPoolExecutor(threads) as pool:
+            for chunk in chunks:
+                pending.append(pool.submit(
+                    self._sendchunk, chunk, expand, retry))
+                if len(pending) >= threads + queue_size:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        pass
+
+
+    def _tunedresults(self, actions, tuner, retry, progress=None,
+                      op_type='index'):
+        """Send bulk actions in chunks adjusted by `tuner`.
+
+        The latency of the first request of every chunk is used to
+        adjust the chunk limits.  See `_bulkresults` for the arguments
+        and produced items.
+        """
+        expand = self._bulkheader(op_type)
+        for chunk in tuner.chunks(actions):
+            if progress:
+                progress.sent += len(chunk)
+                progress.bytes += sum(len(src) for i, src in chunk)
+            yield from self._sendchunk(chunk, expand, retry, tuner)
+        pass
+
+
+    def _sendchunk(self, chunk, expand, retry, tuner=None):
+        """Send one chunk of actions and resend items rejected by busy ES.
+
+        Parameters
+        ----------
+        chunk : list
+            The (_id, _source) pairs to be sent.
+        expand : callable
+            The function which expands an action to bulk header and body.
+        retry : tuple
+            The `max_retries`, `initial_backoff` and `max_backoff`
+            arguments of `upload`.
+        tuner : ChunkTuner, optional
+            The tuner updated with the latency of the first request.
+
+        Returns
+        -------
+        list
+            The triplets of (resent, ok, item) in the order of `chunk`.
+        """
+        from databroker_elasticsearch.bulkstats import isrejected
+        max_retries, initial_backoff, max_backoff = retry
+        rv = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+        for attempt in range(max_retries + 1):
+            if attempt:
+                delay = min(max_backoff, initial_backoff * 2**(attempt - 1))
+                time.sleep(delay)
+            t0 = tuner.timer() if tuner else None
+            mcb = tuner.max_chunk_bytes if tuner else None
+            results = self._sendbulk([chunk[k] for k in pending],
+                                     expand, mcb)
+            rejected = []
+            for k, (ok, item) in zip(pending, results):
+                rv[k] = (attempt, ok, item)
+                if not ok and isrejected(item):
+                    rejected.append(k)
+            if tuner and not attempt:
+                tuner.update(t0, rejected=bool(rejected))
+            if not rejected:
+                break
+            pending = rejected
+        return rv
+
+
+    def _sendbulk(self, actions, expand, max_chunk_bytes=None):
+        """Send bulk actions and return their item results in order.
+
+        Returns
+        -------
+        list
+            The pairs of (ok, item) with the success flag and
+            the Elasticsearch response for every action.
+        """
+        kw = {}
+        if max_chunk_bytes is not None:
+            kw['max_chunk_bytes'] = max_chunk_bytes
+        rv = list(eshelpers.streaming_bulk(
+            self.es, actions, chunk_size=len(actions),
+            expand_action_callback=expand, raise_on_error=False, **kw))
+        return rv
+
+
+    def amend(self, updates, stats=False):
+        """Apply partial updates to existing entries in ES.
+
+        A single update is sent as one `_update` request, several
+        updates are combined into one bulk request.  Updates of missing
+        entries are skipped.
+
+        Parameters
+        ----------
+        updates : iterable
+            The sequence of (_id, fields) pairs.  The entry `_id` gets
+            the new `fields` and keeps all its other fields.
+        stats : bool, optional
+            When True, return `BulkStats` summary instead of count.
+
+        Returns
+        -------
+        int or BulkStats
+            Number of updated entries or the `BulkStats` summary
+            of updated and failed entries.
+        """
+        from databroker_elasticsearch.bulkstats import BulkStats
+        bst = BulkStats()
+        ii = iter(updates)
+        head = list(itertools.islice(ii, 2))
+        if len(head) == 1:
+            self._ensure_index_exists()
+            i, fields = head[0]
+            res = self.es.update(index=self.index, doc_type=self.doc_type,
+                                 id=i, body={"doc": fields}, ignore=404)
+            ok = 'error' not in res
+            bst.add(ok, {"update": dict(res, _id=i)})
+        elif head:
+            self._ensure_index_exists()
+            actions = ((i, {"doc": fields})
+                       for i, fields in itertools.chain(head, ii))
+            res = eshelpers.bulk(
+                self.es, actions, raise_on_error=False,
+                expand_action_callback=self._bulkheader('update'))
+            bst.indexed = res[0]
+            for item in res[1]:
+                bst.add(False, item)
+        rv = bst if stats else bst.indexed
+        return rv
 
 # end of class
+
+# Routines for the worker processes of ElasticIndex._mpgenerate --------------
+
+# ElasticIndex instance for document conversion in the worker process
+_worker_index = None
+
+
+def _initworker(criteria, mapper, hashfield):
+    "Set up document conversion in the worker process."
+    global _worker_index
+    _worker_index = ElasticIndex(None, '', mapper=mapper,
+                                 criteria=criteria, hashfield=hashfield)
+    return
+
+
+def _convertbatch(docs, placeholders=False):
+    "Return list of converted entries for a batch of documents."
+    rv = list(_worker_index._generate(docs, placeholders=placeholders))
+    return rv
+
+
+def _positioned(pending, positions, onresult):
+    """Produce actions from (position, action) pairs for bulk helpers.
+
+    Record the positions of produced actions in `positions` and report
+    None actions directly to the `onresult` function.
+    """
+    for pos, action in pending:
+        if action is None:
+            if onresult is not None:
+                onresult(pos, None)
+            continue
+        positions.append(pos)
+        yield action
+    pass
+
+
+def _batches(items, size):
+    "Generate lists of up to `size` consecutive items."
+    ii = iter(items)
+    batch = list(itertools.islice(ii, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(ii, size))
+    pass
+
+
+def _batchresult(pendingbatch, progress):
+    "Wait for converted batch and account for its input documents."
+    n, res = pendingbatch
+    rv = res.get()
+    if progress:
+        progress.read += n
+        progress.mapped += sum(e is not None for e in rv)
+    return rv
+
+
+def contenthash(doc):
+    """Return stable hash of a dictionary document.
+
+    The hash does not depend on the order of keys in `doc`.
+
+    Parameters
+    ----------
+    doc : dict
+        The document to be hashed.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-1 digest of the canonical JSON of `doc`.
+    """
+    data = json.dumps(doc, sort_keys=True, separators=(',', ':'),
+                      default=str)
+    rv = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    return rv
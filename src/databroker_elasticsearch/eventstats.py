@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""\
+Running statistics of scalar event data in one bluesky run.
+"""
+
+import numpy
+
+
+class EventStats:
+    """Accumulate count, minimum, maximum and mean of scalar data keys.
+
+    The statistics are updated incrementally from "event" and
+    "event_page" documents and use constant memory per data key.
+    Only numeric data keys with scalar shape that are declared in
+    the "descriptor" documents are processed.  Non-finite values
+    are ignored.
+
+    Attributes
+    ----------
+    scalarkeys : dict
+        The names of scalar numeric data keys per descriptor uid.
+    """
+
+    def __init__(self):
+        self.scalarkeys = {}
+        # data key -> [count, minimum, maximum, mean]
+        self._stats = {}
+        return
+
+
+    def add_descriptor(self, doc):
+        """Register scalar numeric data keys from a "descriptor" document.
+        """
+        keys = [k for k, dk in doc['data_keys'].items()
+                if dk.get('dtype') in ('number', 'integer')
+                and not dk.get('shape') and not dk.get('external')]
+        self.scalarkeys[doc['uid']] = keys
+        return
+
+
+    def add_event(self, doc):
+        """Update statistics with values from one "event" document.
+        """
+        data = doc['data']
+        for k in self.scalarkeys.get(doc['descriptor'], ()):
+            if k in data:
+                self._update(k, [data[k]])
+        return
+
+
+    def add_event_page(self, doc):
+        """Update statistics with value arrays from an "event_page" document.
+        """
+        data = doc['data']
+        for k in self.scalarkeys.get(doc['descriptor'], ()):
+            if k in data:
+                self._update(k, data[k])
+        return
+
+
+    def summary(self):
+        """Return statistics of all data keys that had some values.
+
+        Returns
+        -------
+        dict
+            The dictionary of data key names mapped to dictionaries
+            with "count", "min", "max" and "mean" items.
+        """
+        rv = {k: {"count": cnt, "min": lo, "max": hi, "mean": mean}
+              for k, (cnt, lo, hi, mean) in self._stats.items()}
+        return rv
+
+
+    def _update(self, key, values):
+        "Merge array of new values to the running statistics of `key`."
+        try:
+            a = numpy.asarray(values, dtype=float)
+        except (TypeError, ValueError):
+            return
+        a = a[numpy.isfinite(a)]
+        n = a.size
+        if not n:
+            return
+        lo = float(a.min())
+        hi = float(a.max())
+        total = float(a.sum())
+        st = self._stats.get(key)
+        if st is None:
+            self._stats[key] = [n, lo, hi, total / n]
+            return
+        cnt = st[0] + n
+        st[1] = min(st[1], lo)
+        st[2] = max(st[2], hi)
+        st[3] += (total - n * st[3]) / cnt
+        st[0] = cnt
+        return
+
+# end of class
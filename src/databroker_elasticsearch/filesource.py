@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""\
+Streaming retrieval of run start documents from JSON dump files.
+"""
+
+import json
+
+
+def startdocs(source, bufsize=1 << 20):
+    """Iterate over documents stored in a JSON or NDJSON file.
+
+    The file may contain either one top-level JSON array of documents
+    or a sequence of JSON documents separated by whitespace such as
+    newline-delimited JSON.  The file is parsed incrementally so that
+    only the current document and one read buffer are kept in memory.
+    Files with the ".gz" extension are decompressed on the fly.
+
+    Parameters
+    ----------
+    source : str or file
+        The path to the dump file or an open text file object.
+    bufsize : int, optional
+        The number of characters read from the file at once.
+
+    Yield
+    -----
+    dict
+        The documents in the order they appear in the file.
+
+    Raises
+    ------
+    ValueError
+        When the file content is not valid JSON.
+    """
+    if not isinstance(source, str):
+        yield from _parsestream(source, bufsize)
+        return
+    if source.endswith('.gz'):
+        import gzip
+        fp = gzip.open(source, 'rt', encoding='utf-8')
+    else:
+        fp = open(source, encoding='utf-8')
+    with fp:
+        yield from _parsestream(fp, bufsize)
+    pass
+
+
+def _parsestream(fp, bufsize):
+    "Decode JSON array items or concatenated JSON documents from `fp`."
+    decoder = json.JSONDecoder()
+    buf = fp.read(bufsize)
+    eof = not buf
+    pos = _skipspace(buf, 0)
+    while pos == len(buf) and not eof:
+        buf = fp.read(bufsize)
+        eof = not buf
+        pos = _skipspace(buf, 0)
+    inarray = buf.startswith('[', pos)
+    pos += inarray
+    separated = True
+    while True:
+        pos = _skipspace(buf, pos)
+        if inarray and buf.startswith(']', pos):
+            return
+        if inarray and buf.startswith(',', pos) and not separated:
+            separated = True
+            pos += 1
+            continue
+        if pos < len(buf) and separated:
+            try:
+                doc, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof or not _truncated(e):
+                    raise
+            else:
+                yield doc
+                pos = end
+                separated = not inarray
+                continue
+        elif pos < len(buf):
+            emsg = "Expected ',' or ']' at position {} of the array."
+            raise ValueError(emsg.format(pos))
+        if eof:
+            if inarray:
+                raise ValueError("Unterminated JSON array.")
+            return
+        # read at least as much as the pending partial document
+        chunk = fp.read(max(bufsize, len(buf) - pos))
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+    pass
+
+
+def _truncated(err):
+    """Return True if JSON decoding error `err` may be due to end of data.
+
+    The error must happen close to the end of the decoded buffer, where
+    a partial token such as ``tru`` or ``1e`` is possible, or it must be
+    a string without closing quote.
+    """
+    rv = (len(err.doc) - err.pos < 9 or
+          err.msg.startswith('Unterminated string'))
+    return rv
+
+
+def _skipspace(buf, pos):
+    "Return position of the first non-whitespace character from `pos`."
+    n = len(buf)
+    while pos < n and buf[pos] in ' \t\n\r':
+        pos += 1
+    return pos
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""\
+Background thread for sending documents to Elasticsearch.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# marker objects which tell the worker thread to exit or send pending batch
+_STOP = object()
+_FLUSH = object()
+
+
+class IngestWorker:
+    """Send documents to Elasticsearch from a dedicated worker thread.
+
+    Documents are placed on a bounded queue by `submit` which returns
+    immediately unless the queue is full.  The worker thread takes them
+    from the queue and passes them to the `send` function.  When
+    `batchsize` is larger than one, the worker collects documents until
+    there is `batchsize` of them or until `batchtime` seconds elapsed
+    since the first one and sends them together in one call.  Errors in
+    the worker thread are logged and do not stop the processing of
+    subsequent documents.  Pending documents are sent at interpreter exit.
+
+    Parameters
+    ----------
+    send : callable
+        The function which inserts a list of documents to Elasticsearch,
+        for example `ElasticIndex.devour`.
+    maxsize : int, optional
+        The maximum number of documents waiting in the queue.
+        When the queue is full `submit` blocks until there is a free slot.
+    batchsize : int, optional
+        The maximum number of documents sent in one bulk request.
+    batchtime : float, optional
+        The maximum time in seconds that a document waits for
+        other documents to be sent in the same batch.
+
+    Attributes
+    ----------
+    send : callable
+        The function which inserts a list of documents to Elasticsearch.
+    batchsize : int
+        The maximum number of documents sent in one bulk request.
+    batchtime : float
+        The maximum time in seconds that a document waits in a batch.
+    """
+
+    def __init__(self, send, maxsize=1000, batchsize=1, batchtime=0.0):
+        self.send = send
+        self.batchsize = max(1, batchsize)
+        self.batchtime = batchtime
+        self._queue = queue.Queue(maxsize)
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name='IngestWorker', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return
+
+
+    @property
+    def qsize(self):
+        "Number of documents waiting in the queue."
+        return self._queue.qsize()
+
+
+    @property
+    def closed(self):
+        "True when the worker does not accept new documents."
+        return self._closed
+
+
+    def submit(self, doc):
+        """Queue one document for insertion to Elasticsearch.
+
+        Parameters
+        ----------
+        doc : dict
+            The input document to be passed to the `send` function.
+
+        Raises
+        ------
+        RuntimeError
+            When the worker has been already closed.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit to closed IngestWorker.")
+        self._queue.put(doc)
+        return
+
+
+    def flush(self, wait=True):
+        """Send all queued documents without waiting for a full batch.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            When True, block until all queued documents have been
+            processed.  Otherwise only tell the worker to send the
+            pending batch and return at once.
+        """
+        if self._closed:
+            return
+        self._queue.put(_FLUSH)
+        if wait:
+            self._queue.join()
+        return
+
+
+    def close(self):
+        """Process all queued documents and stop the worker thread.
+
+        Calling `close` more than once has no effect.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+        return
+
+
+    def _run(self):
+        "Take documents from the queue and send them to Elasticsearch."
+        marker = None
+        while marker is not _STOP:
+            batch, marker = self._collect()
+            try:
+                self._process(batch)
+            finally:
+                ntaken = len(batch) + (marker is not None)
+                for _ in range(ntaken):
+                    self._queue.task_done()
+        return
+
+
+    def _collect(self):
+        """Gather a batch of documents from the queue.
+
+        Returns
+        -------
+        batch : list
+            The documents to be sent.
+        marker : object or None
+            The `_STOP` or `_FLUSH` marker which ended the batch.
+            None when the batch was ended by its size or time limit.
+        """
+        batch = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.batchtime
+        while item is not _STOP and item is not _FLUSH:
+            batch.append(item)
+            if len(batch) >= self.batchsize:
+                return batch, None
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return batch, None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return batch, None
+        return batch, item
+
+
+    def _process(self, batch):
+        "Insert a batch of documents and log any failure."
+        if not batch:
+            return
+        try:
+            self.send(batch)
+        except Exception:
+            logger.exception("Failed to insert document to Elasticsearch.")
+        return
+
+# end of class
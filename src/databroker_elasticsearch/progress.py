@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""\
+Progress and throughput reporting for long running exports.
+"""
+
+import sys
+import time
+
+
+class Progress:
+    """Counters of documents passing through the export pipeline.
+
+    The counters are updated by `ElasticIndex.devour` and by the
+    `ElasticCallback` rebuild methods.  At most once per `interval`
+    seconds the current rate and ETA are evaluated and `report` is
+    called, which writes one line to `stream`.  Override `report` in
+    a subclass to send progress elsewhere.
+
+    Parameters
+    ----------
+    total : int, optional
+        The expected number of input documents if known.
+    interval : float, optional
+        The minimum time in seconds between two reports.
+    stream : file, optional
+        The output stream of the default `report`.  Use the current
+        `sys.stderr` when not specified.
+
+    Attributes
+    ----------
+    total : int or None
+        The expected number of input documents if known.
+    interval : float
+        The minimum time in seconds between two reports.
+    read : int
+        The number of input documents processed by criteria and mapper.
+    mapped : int
+        The number of converted entries which passed the criteria.
+    sent : int
+        The number of entries sent in bulk requests including resent
+        entries.
+    acked : int
+        The number of entries acknowledged by Elasticsearch.
+    failed : int
+        The number of entries rejected by Elasticsearch.
+    bytes : int
+        The total size of serialized entries sent in bulk requests.
+    rate : float
+        The number of input documents read per second since
+        the previous report.
+    eta : float or None
+        The estimated time in seconds to read the remaining documents
+        or None when `total` is unknown.
+    """
+
+    def __init__(self, total=None, interval=10.0, stream=None):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.read = 0
+        self.mapped = 0
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.bytes = 0
+        self.rate = 0.0
+        self.eta = None
+        self._tstart = time.monotonic()
+        self._tlast = self._tstart
+        self._readlast = 0
+        return
+
+
+    @property
+    def filtered(self):
+        "The number of input documents rejected by the criteria."
+        return self.read - self.mapped
+
+
+    @property
+    def elapsed(self):
+        "The time in seconds since the progress was created."
+        return time.monotonic() - self._tstart
+
+
+    def update(self):
+        """Call `report` if `interval` elapsed since the previous report.
+        """
+        t = time.monotonic()
+        if t - self._tlast >= self.interval:
+            self._measure(t)
+            self.report()
+        return
+
+
+    def done(self):
+        """Call the final `report` unconditionally.
+        """
+        self._measure(time.monotonic())
+        self.report()
+        return
+
+
+    def report(self):
+        """Write the current counters, rate and ETA to `stream`.
+        """
+        stream = self.stream if self.stream is not None else sys.stderr
+        total = '' if self.total is None else '/{}'.format(self.total)
+        eta = ('' if self.eta is None else
+               ' ETA {:.0f}s'.format(self.eta))
+        line = ("read {}{} filtered {} mapped {} sent {} acked {} "
+                "failed {} bytes {} {:.1f} docs/s{}").format(
+                    self.read, total, self.filtered, self.mapped,
+                    self.sent, self.acked, self.failed, self.bytes,
+                    self.rate, eta)
+        print(line, file=stream, flush=True)
+        return
+
+
+    def _measure(self, t):
+        "Evaluate `rate` and `eta` at the monotonic time `t`."
+        dt = t - self._tlast
+        if dt > 0:
+            self.rate = (self.read - self._readlast) / dt
+        if self.total is not None and self.rate > 0:
+            self.eta = max(0, self.total - self.read) / self.rate
+        else:
+            self.eta = None
+        self._tlast = t
+        self._readlast = self.read
+        return
+
+# end of class
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""\
+Append-only file of Elasticsearch entries which wait to be sent.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentSpool:
+    """Write-ahead storage of converted entries for `ElasticIndex`.
+
+    Entries are appended to the spool file before they are sent to
+    Elasticsearch and the file is truncated only after all of them were
+    acknowledged.  Entries that could not be sent stay in the file and
+    are sent in bulk by the next `replay`.  Resending an entry that was
+    already stored is harmless, because it has the same ES identifier.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the spool file.  The file is created when needed.
+
+    Attributes
+    ----------
+    filename : str
+        The path to the spool file with one JSON ``[_id, _source]``
+        array per line.  Partial updates are stored as
+        ``[_id, fields, "update"]``.
+    """
+
+    def __init__(self, filename):
+        from elasticsearch.serializer import JSONSerializer
+        self.filename = filename
+        self._serializer = JSONSerializer()
+        self._lock = threading.RLock()
+        return
+
+
+    def __len__(self):
+        "Number of entries and updates waiting in the spool."
+        with self._lock:
+            rv = sum(1 for _ in self._records())
+        return rv
+
+
+    def append(self, entries, op='index'):
+        """Durably record entries at the end of the spool file.
+
+        Parameters
+        ----------
+        entries : iterable
+            The sequence of (_id, _source) pairs as produced by
+            `ElasticIndex._generate`.
+        op : str, optional
+            The operation for the entries, either "index" for new entries
+            or "update" for (_id, fields) pairs of partial updates.
+        """
+        if op not in ('index', 'update'):
+            raise ValueError("Invalid spool operation {!r}.".format(op))
+        tail = [] if op == 'index' else [op]
+        # use ES serializer defaults for dates, decimals and numpy types
+        fdefault = self._serializer.default
+        lines = [json.dumps(list(e) + tail, default=fdefault) + '\n'
+                 for e in entries]
+        if not lines:
+            return
+        with self._lock, open(self.filename, 'a') as fp:
+            fp.writelines(lines)
+            fp.flush()
+            os.fsync(fp.fileno())
+        return
+
+
+    def read(self, op='index'):
+        """Iterate over the entries stored in the spool.
+
+        Parameters
+        ----------
+        op : str, optional
+            The operation of the entries to be returned,
+            either "index" or "update".
+
+        Yield
+        -----
+        tuple
+            The pairs of (_id, _source) for ES entry identifier and body.
+        """
+        for i, src, rop in self._records():
+            if rop == op:
+                yield (i, src)
+        pass
+
+
+    def _records(self):
+        """Iterate over all records in the spool file.
+
+        Lines which cannot be decoded, for example a partial line
+        from an interrupted write, are logged and skipped.
+
+        Yield
+        -----
+        tuple
+            The triplets of (_id, body, op) for all spooled operations.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename) as fp:
+            for lineno, line in enumerate(fp, 1):
+                try:
+                    i, src, *rop = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipped invalid spool entry at %s:%i.",
+                                   self.filename, lineno)
+                    continue
+                yield (i, src, rop[0] if rop else 'index')
+        pass
+
+
+    def replay(self, esindex, **kwargs):
+        """Send all spooled entries to `esindex` and clear the spool.
+
+        New entries are added first and then partial updates applied.
+        Entries and updates rejected by Elasticsearch with a permanent
+        error are logged and dropped.  Entries that are still rejected
+        by busy Elasticsearch (HTTP 429) after the `ElasticIndex.upload`
+        retries are kept in the spool for the next replay together with
+        their updates.  Updates rejected by busy Elasticsearch are kept
+        as well.  The spool is left intact when the upload fails with
+        connection error.
+
+        Parameters
+        ----------
+        esindex : ElasticIndex
+            The destination for the spooled entries.
+        kwargs : misc, optional
+            Bulk options passed to `ElasticIndex.upload`, for example
+            ``max_retries=0`` to avoid waiting for busy Elasticsearch.
+
+        Returns
+        -------
+        int
+            Number of entries added or updated in Elasticsearch.
+        """
+        with self._lock:
+            if not os.path.exists(self.filename):
+                return 0
+            bst = esindex.upload(self.read(), stats=True, **kwargs)
+            busy = _rejectedids(bst.failures, 'entry')
+            updates = [(i, f) for i, f in self.read(op='update')
+                       if str(i) not in busy]
+            ust = esindex.amend(updates, stats=True)
+            busyupdates = _rejectedids(ust.failures, 'update')
+            cnt = bst.indexed + ust.indexed
+            kept = [(i, src) for i, src in self.read() if str(i) in busy]
+            keptupdates = [(i, f) for i, f in self.read(op='update')
+                           if str(i) in busy or str(i) in busyupdates]
+            if not kept and not keptupdates:
+                self.clear()
+                return cnt
+            # replace the spool file atomically with the kept records
+            tmpspool = DocumentSpool(self.filename + '.tmp')
+            tmpspool.clear()
+            tmpspool.append(kept)
+            tmpspool.append(keptupdates, op='update')
+            os.replace(tmpspool.filename, self.filename)
+        return cnt
+
+
+    def clear(self):
+        """Remove all entries from the spool.
+        """
+        with self._lock:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+        return
+
+# end of class
+
+
+def _rejectedids(failures, kind):
+    """Return ids of failed bulk items that were rejected by busy ES.
+
+    Log the other failed items which are dropped from the spool.
+    """
+    from databroker_elasticsearch.bulkstats import isrejected
+    rv = set()
+    for item in failures:
+        info = next(iter(item.values()), {})
+        if isrejected(item):
+            rv.add(str(info.get('_id')))
+            continue
+        logger.error("Dropped spooled %s rejected by Elasticsearch: %s",
+                     kind, item)
+    return rv
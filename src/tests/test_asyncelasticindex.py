@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""\
+Test the AsyncElasticIndex class.
+"""
+
+import asyncio
+
+import pytest
+
+from databroker_elasticsearch.asyncelasticindex import AsyncElasticIndex
+from databroker_elasticsearch.elasticdocument import ElasticDocument
+from databroker_elasticsearch.elasticindex import ElasticIndex
+
+
+@pytest.fixture
+def aes():
+    from elasticsearch import AsyncElasticsearch
+    e = AsyncElasticsearch()
+    yield e
+    asyncio.run(e.close())
+    return
+
+
+async def aiterate(items):
+    for x in items:
+        yield x
+    return
+
+
+async def alist(aiterable):
+    return [x async for x in aiterable]
+
+
+def test__agenerate(issrecords):
+    docmap = [['uid', '_id'], ['time'], ['time', 'date', 'toisoformat']]
+    kw = dict(mapper=ElasticDocument(docmap),
+              criteria=lambda d: d['time'] > 1518309397)
+    ei = ElasticIndex(None, 'dbes-test-agenerate', **kw)
+    aei = AsyncElasticIndex(None, 'dbes-test-agenerate', **kw)
+    expected = list(ei._generate(issrecords))
+    assert len(expected) == 2
+    assert asyncio.run(alist(aei._agenerate(issrecords))) == expected
+    aentries = aei._agenerate(aiterate(issrecords))
+    assert asyncio.run(alist(aentries)) == expected
+    return
+
+
+def test_sync_methods():
+    aei = AsyncElasticIndex(None, 'dbes-test-async-sync')
+    for name in ('bulkload', 'versions', 'nextversion', 'publish',
+                 'maxtime', 'scanids', 'remove', '_changedentries'):
+        assert not hasattr(aei, name)
+    return
+
+
+def test_ingest_devour_qsearch(aes, issrecords):
+    aei = AsyncElasticIndex(aes, 'dbes-test-async')
+
+    async def run():
+        await aei.reset()
+        assert await aei.ingest({"_id": 1, "fruit": "apple"}) == 1
+        assert await aei.devour(aiterate(issrecords)) == 3
+        await aes.indices.refresh(index=aei.index)
+        res = await aei.qsearch('*')
+        assert res['hits']['total'] == 4
+        res = await aei.qsearch(query={'query': {'match': {'fruit': 'apple'}}})
+        assert res['hits']['total'] == 1
+        with pytest.raises(TypeError):
+            await aei.qsearch('*', index='dummy')
+        await aes.indices.delete(index=aei.index)
+        return
+
+    asyncio.run(run())
+    return
+
+
+def test_from_config_hashfield(issrecords):
+    config = {'databroker-elasticsearch': {
+        'host': 'http://localhost:9200',
+        'index': 'dbes-test-async-hash',
+        'hashfield': 'chash',
+        'docmap': [['uid', '_id'], ['time']],
+    }}
+    aei = AsyncElasticIndex.from_config(config)
+    assert isinstance(aei, AsyncElasticIndex)
+    assert aei.hashfield == 'chash'
+    assert aei.doc_properties['chash']['index'] is False
+    ei = ElasticIndex(None, 'dbes-test-async-hash', mapper=aei.mapper,
+                      hashfield='chash')
+    expected = list(ei._generate(issrecords))
+    assert 'chash' in expected[0][1]
+    assert asyncio.run(alist(aei._agenerate(issrecords))) == expected
+    asyncio.run(aei.close())
+    return
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+"""\
+Test the BulkStats class.
+"""
+
+from databroker_elasticsearch.bulkstats import BulkStats
+
+
+def test_add():
+    bst = BulkStats()
+    bst.add(True, {'index': {'_id': 1, 'status': 201}})
+    bst.add(False, {'index': {'_id': 2, 'status': 400, 'error': {
+        'type': 'mapper_parsing_exception', 'reason': 'failed to parse'}}})
+    bst.add(False, {'index': {'_id': 3, 'status': 400, 'error': {
+        'type': 'mapper_parsing_exception', 'reason': 'failed to parse'}}})
+    bst.add(False, {'index': {'_id': 4, 'status': 503, 'error': 'timeout'}})
+    assert bst.indexed == 1
+    assert bst.failed == 3
+    assert bst.errors == {'mapper_parsing_exception': 2, 'timeout': 1}
+    assert 'indexed=1' in repr(bst)
+    return
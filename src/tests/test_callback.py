@@ -5,11 +5,15 @@ Test the ElasticCallback class.
 """
 
 import collections
+import os
 
 import pytest
+from elasticsearch import Elasticsearch
 
 from conftest import tdatafile
 from databroker_elasticsearch import callback_from_name
+from databroker_elasticsearch.checkpoint import Checkpoint
+from databroker_elasticsearch.elasticcallback import ElasticCallback
 
 # Ignore YAMLLoadWarning from databroker package
 pytestmark = pytest.mark.filterwarnings('ignore:calling yaml::databroker[.]')
@@ -47,6 +51,16 @@ def cb(es):
     return cb
 
 
+@pytest.fixture
+def ei(es, request):
+    "Create empty ElasticIndex from config file for the parametrized index."
+    ei = callback_from_name(tdatafile('dbes.yml')).esindex
+    ei.es = es
+    ei.index = request.param
+    ei.reset()
+    return ei
+
+
 @pytest.mark.parametrize('criteria,count', [(None, 3), (require_pi, 2)])
 def test_callback_start(cb, criteria, count, issrecords):
     cb.esindex.criteria = criteria
@@ -97,3 +111,246 @@ def test_callback_new_index(cb, issrecords):
     assert indexproperties(cb)['time'] == ei.doc_properties['time']
     assert indexcount(cb) == 3
     return
+
+
+@pytest.mark.parametrize('ei', ['dbes-test-background'], indirect=True)
+def test_callback_background(ei, issrecords):
+    cb = ElasticCallback(ei, background=True, queuesize=2)
+    for doc in issrecords:
+        cb("start", doc)
+    cb.flush()
+    assert cb.queue_depth == 0
+    assert indexcount(cb) == 3
+    cb.close()
+    assert cb.worker.closed
+    return
+
+
+@pytest.mark.parametrize('ei', ['dbes-test-batch'], indirect=True)
+def test_callback_batch(ei, issrecords):
+    cb = ElasticCallback(ei, batchsize=10, batchtime=60)
+    assert cb.worker is not None
+    for doc in issrecords:
+        cb("start", doc)
+    cb("stop", {"uid": "stop1", "run_start": doc['uid']})
+    cb.close()
+    assert indexcount(cb) == 3
+    return
+
+
+@pytest.mark.parametrize('ei', ['dbes-test-spool'], indirect=True)
+def test_callback_spool(es, ei, issrecords, tmp_path):
+    cb = ElasticCallback(ei, spool=str(tmp_path / 'dbes.spool'))
+    # simulate unreachable Elasticsearch server
+    ei.es = Elasticsearch('localhost:1', max_retries=0)
+    cb("start", issrecords[0])
+    assert len(cb.spool) == 1
+    ei.es = es
+    cb("start", issrecords[1])
+    assert len(cb.spool) == 0
+    assert indexcount(cb) == 2
+    cb.spool.append(ei._generate(issrecords[2:]))
+    assert cb.replay() == 1
+    assert indexcount(cb) == 3
+    return
+
+
+@pytest.mark.parametrize('ei', ['dbes-test-stop'], indirect=True)
+@pytest.mark.parametrize('batchsize', [1, 10])
+def test_callback_stop(es, ei, issrecords, batchsize):
+    cb = ElasticCallback(ei, batchsize=batchsize)
+    doc = issrecords[0]
+    cb("start", doc)
+    stopdoc = {"uid": "stop1", "run_start": doc['uid'],
+               "time": doc['time'] + 12.5, "exit_status": "success",
+               "reason": "", "num_events": {"primary": 7, "baseline": 2}}
+    cb("stop", stopdoc)
+    # stop of an unknown run is ignored
+    cb("stop", dict(stopdoc, run_start='unknown'))
+    cb.flush()
+    es.indices.refresh()
+    src = es.get(index=ei.index, doc_type=ei.doc_type,
+                 id=doc['uid'])['_source']
+    assert src['uid'] == doc['uid']
+    assert src['exit_status'] == 'success'
+    assert src['complete'] is True
+    assert src['duration'] == 12.5
+    assert src['num_events'] == 9
+    assert 'reason' not in src
+    return
+
+
+@pytest.mark.parametrize('ei', ['dbes-test-eventstats'], indirect=True)
+def test_callback_eventstats(es, ei, issrecords):
+    cb = ElasticCallback(ei, eventstats=True)
+    doc = issrecords[0]
+    cb("start", doc)
+    cb("descriptor", {"uid": "d1", "run_start": doc['uid'],
+                      "data_keys": {"I0": {"dtype": "number", "shape": []}}})
+    cb("event", {"uid": "e1", "descriptor": "d1", "data": {"I0": 3.0}})
+    cb("event_page", {"uid": ["e2", "e3"], "descriptor": "d1",
+                      "data": {"I0": [1.0, 5.0]}})
+    cb("stop", {"uid": "stop1", "run_start": doc['uid'],
+                "time": doc['time'] + 1, "exit_status": "success"})
+    assert not cb._descstats
+    es.indices.refresh()
+    src = es.get(index=ei.index, doc_type=ei.doc_type,
+                 id=doc['uid'])['_source']
+    assert src['stats']['I0'] == {"count": 3, "min": 1.0,
+                                  "max": 5.0, "mean": 3.0}
+    return
+
+
+def test_callback_rebuild_processes(cb, issrecords):
+    cb.esindex.criteria = require_pi
+    Header = collections.namedtuple('Header', 'start')
+    headers = [Header(start=dict(doc, uid=doc['uid'] + str(i)))
+               for i in range(10) for doc in issrecords]
+    cnt = cb.rebuild(headers, purge=True, processes=2, threads=2)
+    assert cnt == 20
+    assert indexcount(cb) == 20
+    return
+
+
+def test_callback_rebuild_resume(cb, issrecords, tmp_path):
+    ckfile = str(tmp_path / 'rebuild.ckpt')
+    Header = collections.namedtuple('Header', 'start')
+    headers = [Header(start=dict(doc, uid=doc['uid'] + str(i)))
+               for i in range(4) for doc in issrecords]
+    # simulate rebuild interrupted after the first 5 headers
+    cnt = cb.rebuild(headers[:5], purge=True,
+                     checkpoint=ckfile, chunk_size=2)
+    assert cnt == 5
+    assert not os.path.exists(ckfile)
+    ckpt = Checkpoint(ckfile)
+    ckpt.advance([h.start for h in headers[:5]], 5)
+    ckpt.save()
+    cnt = cb.rebuild(headers, purge=True, checkpoint=ckfile,
+                     resume=True, chunk_size=2)
+    assert cnt == 12
+    assert indexcount(cb) == 12
+    assert not os.path.exists(ckfile)
+    # resumed headers must match the checkpoint
+    ckpt.save()
+    with pytest.raises(ValueError):
+        cb.rebuild(headers[1:], checkpoint=ckfile, resume=True)
+    return
+
+
+def test_callback_sync(cb, db, issrecords):
+    cb.esindex.index = 'dbes-test-sync'
+    assert cb.esindex.maxtime() is None
+    for doc in issrecords:
+        db.insert('start', doc)
+    assert cb.sync(db) == 3
+    es = cb.esindex.es
+    es.indices.refresh()
+    tmax = max(doc['time'] for doc in issrecords)
+    assert cb.esindex.maxtime() == pytest.approx(tmax, abs=1e-3)
+    # runs in the overlap are already indexed and are not sent again
+    assert cb.sync(db, overlap=0) == 0
+    assert cb.sync(db, overlap=1e9) == 0
+    assert indexcount(cb) == 3
+    with pytest.raises(TypeError):
+        cb.sync(db, purge=True)
+    return
+
+
+def test_callback_sync_keeps_stop(cb, db, issrecords):
+    ei = cb.esindex
+    ei.index = 'dbes-test-sync-stop'
+    docs = [dict(doc, uid='ss-' + doc['uid']) for doc in issrecords]
+    for doc in docs:
+        db.insert('start', doc)
+    doc = max(docs, key=lambda d: d['time'])
+    cb("start", doc)
+    cb("stop", {"uid": "ss-stop", "run_start": doc['uid'],
+                "time": doc['time'] + 5, "exit_status": "success"})
+    ei.es.indices.refresh()
+    assert cb.sync(db, overlap=1e9) == len(list(db())) - 1
+    src = ei.es.get(index=ei.index, doc_type=ei.doc_type,
+                    id=doc['uid'])['_source']
+    assert src['exit_status'] == 'success'
+    assert src['duration'] == 5
+    return
+
+
+def test_callback_rebuild_versioned(cb, issrecords):
+    cb.esindex.index = 'dbes-test-cbversioned'
+    Header = collections.namedtuple('Header', 'start')
+    headers = [Header(start=doc) for doc in issrecords]
+    assert cb.rebuild(headers[:1], versioned=True) == 1
+    assert indexcount(cb) == 1
+    assert cb.rebuild(headers, versioned=True, keep=1) == 3
+    assert indexcount(cb) == 3
+    assert cb.esindex.versions() == [2]
+    with pytest.raises(ValueError):
+        cb.rebuild(headers, versioned=True, resume=True)
+    return
+
+
+def test_callback_rebuild_purge_versioned(cb, issrecords):
+    ei = cb.esindex
+    ei.index = 'dbes-test-cbpurgeversioned'
+    Header = collections.namedtuple('Header', 'start')
+    headers = [Header(start=doc) for doc in issrecords]
+    assert cb.rebuild(headers, versioned=True) == 3
+    assert ei.es.indices.exists_alias(name=ei.index)
+    assert cb.rebuild(headers[:2], purge=True) == 2
+    assert not ei.es.indices.exists_alias(name=ei.index)
+    assert indexcount(cb) == 2
+    assert ei.versions() == []
+    return
+
+
+def test_callback_reconcile(cb, db, issrecords):
+    ei = cb.esindex
+    ei.index = 'dbes-test-reconcile'
+    docs = [dict(doc, uid='rc-' + doc['uid']) for doc in issrecords]
+    for doc in docs:
+        db.insert('start', doc)
+    nruns = len(list(db()))
+    ei.devour(docs[:1])
+    ei.devour([{"uid": "not-in-databroker"}])
+    ei.es.index(index=ei.index, doc_type=ei.doc_type, id='nouid',
+                body={"name": "no uid here"})
+    ei.es.indices.refresh()
+    added, deleted = cb.reconcile(db)
+    assert (added, deleted) == (nruns - 1, 2)
+    assert indexcount(cb) == nruns
+    assert cb.reconcile(db) == (0, 0)
+    # without _id from uid nothing can be matched or deleted
+    ei.mapper = None
+    with pytest.raises(ValueError):
+        cb.reconcile(db)
+    assert indexcount(cb) == nruns
+    return
+
+
+def test_callback_rebuilddb(cb, db, issrecords):
+    cb.esindex.index = 'dbes-test-rebuilddb'
+    for doc in issrecords:
+        db.insert('start', dict(doc, uid='rd-' + doc['uid']))
+    nruns = len(list(db()))
+    assert cb.rebuilddb(db, purge=True) == nruns
+    assert indexcount(cb) == nruns
+    t0 = max(doc['time'] for doc in issrecords)
+    assert cb.rebuilddb(db, since=t0) == len(list(db(since=t0)))
+    return
+
+
+def test_callback_rebuild_progress(cb, issrecords, capsys):
+    Header = collections.namedtuple('Header', 'start')
+    headers = [Header(start=doc) for doc in issrecords]
+    assert cb.rebuild(headers, purge=True, progress=True) == 3
+    err = capsys.readouterr().err
+    assert err.startswith('read 3/3 filtered 0 mapped 3 sent 3 acked 3')
+    assert len(err.splitlines()) == 1
+    return
+
+
+def test_callback_rebuildfile(cb):
+    cb.esindex.index = 'dbes-test-rebuildfile'
+    assert cb.rebuildfile(tdatafile('iss-sample.json'), purge=True) == 3
+    assert indexcount(cb) == 3
+    return
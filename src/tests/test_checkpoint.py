@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+"""\
+Test the Checkpoint class.
+"""
+
+import os
+
+from databroker_elasticsearch.checkpoint import Checkpoint
+
+
+def test_save_load(tmp_path):
+    filename = str(tmp_path / 'rebuild.ckpt')
+    ckpt = Checkpoint(filename)
+    assert not ckpt.load()
+    ckpt.advance([{'uid': 'a', 'time': 1.0}, {'uid': 'b', 'time': 2.0}], 1)
+    ckpt.advance([], 0)
+    ckpt.save()
+    ckpt1 = Checkpoint(filename)
+    assert ckpt1.load()
+    assert (ckpt1.count, ckpt1.uid, ckpt1.indexed) == (2, 'b', 1)
+    assert not os.path.exists(filename + '.tmp')
+    ckpt1.remove()
+    assert not os.path.exists(filename)
+    assert not ckpt1.load()
+    assert ckpt1.count == 0
+    return
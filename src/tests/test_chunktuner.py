@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""\
+Test the ChunkTuner class.
+"""
+
+import json
+import time
+
+from databroker_elasticsearch.chunktuner import ChunkTuner
+
+
+class Serializer:
+    dumps = staticmethod(json.dumps)
+
+
+def entries(n, nbytes=1):
+    rv = [(i, {'x': 'a' * nbytes}) for i in range(n)]
+    return rv
+
+
+def test_chunks():
+    tuner = ChunkTuner(Serializer(), 1.0, chunk_size=4, chunk_bytes=10**6)
+    chunks = list(tuner.chunks(entries(10)))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+    assert chunks[0][0] == (0, '{"x": "a"}')
+    # limit by the size in bytes
+    tuner.chunk_bytes = 250
+    chunks = list(tuner.chunks(entries(10, nbytes=100)))
+    assert [len(c) for c in chunks] == [2, 2, 2, 2, 2]
+    return
+
+
+def test_update():
+    tuner = ChunkTuner(Serializer(), 1.0, chunk_size=100, chunk_bytes=10**6)
+    tuner.update(time.monotonic())
+    assert tuner.chunk_size == 200
+    assert tuner.chunk_bytes == 2 * 10**6
+    tuner.update(time.monotonic() - 4)
+    assert tuner.chunk_size == 100
+    tuner.update(time.monotonic(), rejected=True)
+    assert tuner.chunk_size == 50
+    for i in range(10):
+        tuner.update(time.monotonic(), rejected=True)
+    assert tuner.chunk_size == ChunkTuner.min_chunk_size
+    assert tuner.chunk_bytes == ChunkTuner.min_chunk_bytes
+    return
@@ -10,6 +10,8 @@ import time
 import pytest
 
 from databroker_elasticsearch.converters import getconverter
+from databroker_elasticsearch.converters import getbatchconverter
+from databroker_elasticsearch.converters import getesproperty
 
 
 def test_simple_converters():
@@ -41,6 +43,16 @@ def test_toisoformat():
     return
 
 
+@pytest.mark.usefixtures('use_est_timezone')
+def test_toisoformat_many():
+    fcnv = getconverter('toisoformat')
+    fbatch = getbatchconverter(fcnv)
+    epochs = [0, 0.5, 1514826000.1235, 1514826000 + 86400 * 180]
+    assert fbatch(epochs) == list(map(fcnv, epochs))
+    assert getbatchconverter(getconverter('noconversion')) is None
+    return
+
+
 def test_normalize_counts():
     f = getconverter('normalize_counts')
     assert f(99) is None
@@ -55,3 +67,24 @@ def test_listofstrings():
     words = 'one two three'.split()
     assert f(words) is words
     return
+
+
+def test_text():
+    f = getconverter('text')
+    assert f(3) == '3'
+    assert getesproperty(f) == ({'type': 'text'}, None)
+    return
+
+
+def test_getesproperty():
+    assert getesproperty(int) == ({'type': 'long'}, None)
+    prop, items = getesproperty(getconverter('normalize_counts'))
+    assert prop['type'] == 'object' and items == {'type': 'double'}
+    prop['type'] = 'changed'
+    prop, items = getesproperty(getconverter('normalize_counts'))
+    assert prop['type'] == 'object'
+    assert getesproperty(getconverter('noconversion')) == (None, None)
+    f = lambda x: x
+    f.esproperty = {'type': 'ip'}
+    assert getesproperty(f) == ({'type': 'ip'}, None)
+    return
@@ -4,6 +4,8 @@
 Test the ElasticDocument translator class.
 """
 
+import pickle
+
 from databroker_elasticsearch.elasticdocument import ElasticDocument
 from databroker_elasticsearch import converters
 
@@ -26,3 +28,120 @@ def test___call__():
     src.pop('names')
     assert {'_id': 1} == esdoc(src)
     return
+
+
+def test_compile():
+    docmap = [['uid', '_id', str], ['time'], ['time', 'date', 'toisoformat'],
+              ['a', 'x'], ['b', 'x', 'listofstrings'], ["it's", 'q', int]]
+    esdoc = ElasticDocument(docmap)
+    src = {'uid': 7, 'time': 0.0, 'a': 1, 'b': ['B'], "it's": '3'}
+    res = esdoc(src)
+    assert res == {'_id': '7', 'time': 0.0, 'x': ['B'], 'q': 3,
+                   'date': converters.toisoformat(0.0)}
+    assert list(res) == ['_id', 'time', 'date', 'x', 'q']
+    src.update(time=None, b=[1])
+    assert esdoc(src) == {'_id': '7', 'x': 1, 'q': 3}
+    esdoc.docmap.pop()
+    assert 'q' in esdoc(src)
+    esdoc.compile()
+    assert 'q' not in esdoc(src)
+    esdoc1 = pickle.loads(pickle.dumps(esdoc))
+    assert esdoc1(src) == esdoc(src)
+    return
+
+
+def test_map_many():
+    docmap = [['uid', '_id', str], ['time'], ['time', 'date', 'toisoformat'],
+              ['a', 'x'], ['t', 'x', 'toisoformat'], ['n', 'n', int]]
+    esdoc = ElasticDocument(docmap)
+    docs = [{'uid': i, 'time': 1e9 + i, 'a': i, 't': 1.0, 'n': '1'}
+            for i in range(5)]
+    docs += [{'uid': 7}, {'uid': 8, 'time': None, 't': None}]
+    assert esdoc.map_many(iter(docs)) == list(map(esdoc, docs))
+    assert esdoc.map_many([]) == []
+    calls = []
+
+    def double(v):
+        return 2 * v
+
+    def doublemany(values):
+        calls.append(len(values))
+        return [None if v == 3 else 2 * v for v in values]
+
+    double.batch = doublemany
+    esdoc = ElasticDocument([['a', 'b', double]])
+    res = esdoc.map_many([{'a': 1}, {'a': 3}, {}, {'a': 4}])
+    assert res == [{'b': 2}, {}, {}, {'b': 8}]
+    assert calls == [3]
+    return
+
+
+def test_dotted_paths():
+    docmap = [['md.proposal.id', 'proposal', int], ['md.proposal.title'],
+              ['detectors[0]', 'det0'], ['detectors[-1]', 'detlast'],
+              ['md.runs[1].uid', 'uid1'], ['sample'], ['plain key']]
+    esdoc = ElasticDocument(docmap)
+    src = {'md': {'proposal': {'id': '12', 'title': 'T'},
+                  'runs': [{'uid': 'a'}, {'uid': 'b'}]},
+           'detectors': ['d1', 'd2'], 'sample': {'x': 1}, 'plain key': 0}
+    assert esdoc(src) == {'proposal': 12, 'md.proposal.title': 'T',
+                          'det0': 'd1', 'detlast': 'd2', 'uid1': 'b',
+                          'sample': {'x': 1}, 'plain key': 0}
+    bad = {'md': {'proposal': 'string', 'runs': [{'uid': 'a'}]},
+           'detectors': 'not-a-list'}
+    assert esdoc(bad) == {}
+    assert esdoc({'md': None, 'detectors': []}) == {}
+    assert esdoc.map_many([src, bad]) == [esdoc(src), {}]
+    return
+
+
+def test_patterns():
+    docmap = [['uid', '_id'], ['pba*_adc? offset', r'offsets.\g<0>', float],
+              [r'/(\w+)_gain/', r'gain.\1'], ['*_mode']]
+    esdoc = ElasticDocument(docmap)
+    src = {'uid': 'a', 'pba1_adc6 offset': '0.5', 'pba2_adc7 offset': 1,
+           'pba1_adc10 offset': 2, 'amp_gain': 3, 'run_mode': 'fly'}
+    res = {'_id': 'a', 'offsets.pba1_adc6 offset': 0.5,
+           'offsets.pba2_adc7 offset': 1.0, 'gain.amp': 3, 'run_mode': 'fly'}
+    assert esdoc(src) == res
+    assert len(esdoc._plans) == 1
+    src1 = dict(src, uid='b')
+    assert esdoc(src1) == dict(res, _id='b')
+    assert len(esdoc._plans) == 1
+    other = {'uid': 'c', 'x_mode': None, 'y_mode': 'step'}
+    assert esdoc.map_many([src, other, src1]) == [
+        res, {'_id': 'c', 'y_mode': 'step'}, dict(res, _id='b')]
+    assert len(esdoc._plans) == 2
+    esdoc.maxplans = 2
+    esdoc({'uid': 'd'})
+    assert len(esdoc._plans) == 1
+    esdoc1 = pickle.loads(pickle.dumps(esdoc))
+    assert esdoc1(src) == res
+    return
+
+
+def test_esproperties():
+    docmap = [['uid', '_id', str], ['n', 'n', int],
+              ['t', 'date', 'toisoformat'],
+              ['names', 'names', 'listofstrings'],
+              ['formula', 'composition', 'normalize_counts'],
+              [r'/(\w+)_offset/', r'offset.\1', float]]
+    esdoc = ElasticDocument(docmap)
+    properties, templates, untyped = esdoc.esproperties()
+    assert properties['n'] == {'type': 'long'}
+    assert properties['date']['type'] == 'date'
+    assert properties['names'] == {'type': 'keyword'}
+    assert properties['composition'] == properties['offset'] == {
+        'type': 'object', 'dynamic': True}
+    assert '_id' not in properties
+    assert templates == [
+        {'composition_items': {'path_match': 'composition.*',
+                               'mapping': {'type': 'double'}}},
+        {'offset_items': {'path_match': 'offset.*',
+                          'mapping': {'type': 'double'}}}]
+    assert untyped == set()
+    esdoc = ElasticDocument([['a'], ['b*', 'b*', int], ['c', 'c', str]])
+    properties, templates, untyped = esdoc.esproperties()
+    assert properties == {'c': {'type': 'keyword'}}
+    assert untyped == {'a', 'b*'}
+    return
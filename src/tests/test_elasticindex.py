@@ -4,9 +4,13 @@
 Test the ElasticIndex class.
 """
 
+import io
+import json
+
 import pytest
 
 from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch.helpers import BulkIndexError
 from databroker_elasticsearch.elasticindex import ElasticIndex
 
 
@@ -113,3 +117,317 @@ def test_devour(es):
     cnt = int(es.cat.count(ei.index, h='count'))
     assert cnt == 3
     return
+
+
+def test_amend(es):
+    ei = ElasticIndex(es, 'dbes-test-amend')
+    ei.reset()
+    ei.devour([{"_id": 1, "a": 1}, {"_id": 2, "a": 2}])
+    assert ei.amend([]) == 0
+    assert ei.amend([(1, {"b": 1})]) == 1
+    assert ei.amend([(3, {"b": 3})]) == 0
+    assert ei.amend([(1, {"c": 1}), (2, {"c": 2}), (3, {"c": 3})]) == 2
+    bst = ei.amend([(2, {"d": 2}), (4, {"d": 4})], stats=True)
+    assert (bst.indexed, bst.failed) == (1, 1)
+    assert ei.amend([(5, {"d": 5})], stats=True).failures[0]['update'][
+        '_id'] == 5
+    src = es.get(index=ei.index, doc_type=ei.doc_type, id=1)['_source']
+    assert src == {"a": 1, "b": 1, "c": 1}
+    return
+
+
+def test_devour_parallel(es):
+    ei = ElasticIndex(es, 'dbes-test-devour-parallel')
+    ei.reset()
+    docs = [{"_id": i, "number": i} for i in range(100)]
+    docs[7]["number"] = "not a number"
+    bst = ei.devour(docs, threads=3, chunk_size=10, stats=True)
+    assert bst.indexed == 99
+    assert bst.failed == 1
+    assert bst.errors == {'mapper_parsing_exception': 1}
+    assert ei.devour(docs[:5], threads=2) == 5
+    return
+
+
+class BusyIndex(ElasticIndex):
+    "ElasticIndex with simulated bulk responses from a busy server."
+
+    def __init__(self, rejections):
+        super().__init__(None, 'dbes-test-busy')
+        self.rejections = rejections
+        self.existing = set()
+        self.sent = []
+        return
+
+    def _ensure_index_exists(self):
+        return
+
+    def _sendbulk(self, actions, expand, max_chunk_bytes=None):
+        rv = []
+        for a in actions:
+            i = a[0]
+            op = next(iter(json.loads(expand(a)[0])))
+            self.sent.append(i)
+            if op == 'create' and i in self.existing:
+                rv.append((False, {op: {'_id': i, 'status': 409, 'error': {
+                    'type': 'version_conflict_engine_exception'}}}))
+            elif self.rejections.get(i, 0) > 0:
+                self.rejections[i] -= 1
+                rv.append((False, {op: {'_id': i, 'status': 429, 'error': {
+                    'type': 'es_rejected_execution_exception'}}}))
+            elif i < 0:
+                rv.append((False, {op: {'_id': i, 'status': 400, 'error': {
+                    'type': 'mapper_parsing_exception'}}}))
+            else:
+                rv.append((True, {op: {'_id': i, 'status': 201}}))
+        return rv
+
+
+def test_upload_retries():
+    ei = BusyIndex({2: 1, 3: 2, 4: 5})
+    entries = [(i, {}) for i in (-1, 1, 2, 3, 4)]
+    bst = ei.upload(entries, max_retries=3, initial_backoff=0, stats=True)
+    assert ei.sent == [-1, 1, 2, 3, 4, 2, 3, 4, 3, 4, 4]
+    assert bst.indexed == 3
+    assert bst.retried == 6
+    assert bst.failed == 2
+    assert bst.errors == {'mapper_parsing_exception': 1,
+                          'es_rejected_execution_exception': 1}
+    # rejected entries are resent before the next chunk
+    ei = BusyIndex({2: 1})
+    bst = ei.upload(entries, chunk_size=2, initial_backoff=0, stats=True)
+    assert ei.sent == [-1, 1, 2, 3, 2, 4]
+    assert (bst.indexed, bst.retried) == (4, 1)
+    ei = BusyIndex({2: 1})
+    bst = ei.upload(entries, chunk_size=2, initial_backoff=0, threads=2,
+                    stats=True)
+    assert (bst.indexed, bst.retried) == (4, 1)
+    ei = BusyIndex({})
+    with pytest.raises(BulkIndexError):
+        ei.upload(entries, initial_backoff=0)
+    return
+
+
+def test_upload_create():
+    ei = BusyIndex({})
+    ei.existing.update([1, 3])
+    entries = [(i, {}) for i in (1, 2, 3)]
+    results = []
+    bst = ei.upload(entries, stats=True, op_type='create',
+                    onresult=lambda pos, ok: results.append((pos, ok)))
+    assert (bst.indexed, bst.unchanged, bst.failed) == (1, 2, 0)
+    assert results == [(0, None), (1, True), (2, None)]
+    assert ei.upload(entries, op_type='index') == 3
+    with pytest.raises(ValueError):
+        ei.upload(entries, op_type='delete')
+    return
+
+
+def test_upload_onresult():
+    ei = BusyIndex({2: 1, 4: 5})
+    entries = [(i, {}) for i in (-1, 1, 2, 3, 4)]
+    entries.insert(2, None)
+    results = []
+    bst = ei.upload(entries, max_retries=2, initial_backoff=0, stats=True,
+                    onresult=lambda pos, ok: results.append((pos, ok)))
+    assert ei.sent == [-1, 1, 2, 3, 4, 2, 4, 4]
+    assert results == [(2, None), (0, False), (1, True), (3, True),
+                       (4, True), (5, False)]
+    assert (bst.indexed, bst.failed) == (3, 2)
+    return
+
+
+def test_devour_tuned(es):
+    ei = ElasticIndex(es, 'dbes-test-devour-tuned')
+    ei.reset()
+    docs = [{"_id": i, "number": i} for i in range(1000)]
+    bst = ei.devour(docs, chunk_size=10, target_latency=0.5, stats=True)
+    assert bst.indexed == 1000
+    assert bst.chunk_size > 10
+    assert bst.chunk_bytes is not None
+    bst = ei.devour(docs[:10], chunk_size=10, stats=True)
+    assert (bst.chunk_size, bst.chunk_bytes) == (10, None)
+    return
+
+
+def test__generate_newdict():
+    src = {"_id": 1, "fruit": "apple"}
+    ei = ElasticIndex(None, 'dbes-test-generate')
+    assert list(ei._generate([src])) == [(1, {"fruit": "apple"})]
+    assert src == {"_id": 1, "fruit": "apple"}
+    ei.mapper = lambda e: e
+    ei.mapper.newdict = True
+    assert list(ei._generate([src])) == [(1, {"fruit": "apple"})]
+    assert src == {"fruit": "apple"}
+    return
+
+
+def test_devour_skipunchanged(es):
+    ei = ElasticIndex(es, 'dbes-test-skipunchanged', hashfield='chash')
+    ei.reset()
+    docs = [{"_id": i, "number": i} for i in range(20)]
+    assert ei.devour(docs) == 20
+    docs[3] = {"_id": 3, "number": -3}
+    docs.append({"_id": 20, "number": 20})
+    bst = ei.devour(docs, skipunchanged=True, stats=True)
+    assert (bst.indexed, bst.unchanged) == (2, 19)
+    ei.hashfield = None
+    with pytest.raises(ValueError):
+        ei.devour(docs, skipunchanged=True)
+    return
+
+
+def isodd(doc):
+    return doc["number"] % 2
+
+
+def test_devour_progress(es):
+    from databroker_elasticsearch.progress import Progress
+    ei = ElasticIndex(es, 'dbes-test-progress', criteria=isodd)
+    ei.reset()
+    docs = [{"_id": i, "number": i} for i in range(100)]
+    p = Progress(stream=io.StringIO())
+    assert ei.devour(docs, chunk_size=10, progress=p) == 50
+    assert (p.read, p.filtered, p.mapped) == (100, 50, 50)
+    assert (p.sent, p.acked, p.failed) == (50, 50, 0)
+    assert p.bytes > 50
+    assert p.stream.getvalue() == ''
+    p1 = Progress(stream=io.StringIO())
+    ei.devour(docs, processes=2, target_latency=1, progress=p1)
+    assert (p1.read, p1.mapped, p1.sent, p1.bytes) == (100, 50, 50, p.bytes)
+    return
+
+
+def test__generate_hashfield():
+    ei = ElasticIndex(None, 'dbes-test-hash', hashfield='chash')
+    e1, = ei._generate([{"_id": 1, "a": 1, "b": [2, 3]}])
+    e2, = ei._generate([{"b": [2, 3], "a": 1, "_id": 2}])
+    e3, = ei._generate([{"_id": 1, "a": 1, "b": [3, 2]}])
+    assert e1[1]['chash'] == e2[1]['chash']
+    assert e1[1]['chash'] != e3[1]['chash']
+    assert set(e1[1]) == {"a", "b", "chash"}
+    return
+
+
+def test_entryid():
+    from databroker_elasticsearch.elasticdocument import ElasticDocument
+    ei = ElasticIndex(None, 'dbes-test-entryid')
+    assert ei.entryid({'_id': 7, 'uid': 'a'}) == '7'
+    ei.mapper = ElasticDocument([['uid', '_id'], ['time']])
+    assert ei.entryid({'uid': 'a'}) == 'a'
+    assert ei.entryid({'time': 1}) is None
+    return
+
+
+def test__bulkheader():
+    ei = ElasticIndex(None, 'dbes-test-header')
+    expand = ei._bulkheader()
+    src = {"fruit": "apple"}
+    line, body = expand(("a1", src))
+    assert json.loads(line) == {"index": {"_index": "dbes-test-header",
+                                          "_type": "run_start",
+                                          "_id": "a1"}}
+    assert body is src
+    line, body = ei._bulkheader('update')((2, {"doc": src}))
+    assert json.loads(line)["update"]["_id"] == 2
+    return
+
+
+def test__generate_placeholders():
+    docs = [{"_id": i, "number": i} for i in range(7)]
+    ei = ElasticIndex(None, 'dbes-test-placeholders', criteria=isodd)
+    expected = [(i, {"number": i}) if i % 2 else None for i in range(7)]
+    assert list(ei._generate(docs, batchsize=3,
+                             placeholders=True)) == expected
+    assert list(ei._mpgenerate(docs, 2, batchsize=3,
+                               placeholders=True)) == expected
+    assert list(ei._generate(docs)) == [e for e in expected if e]
+    return
+
+
+def test__mpgenerate(issrecords):
+    from databroker_elasticsearch.elasticdocument import ElasticDocument
+    docmap = [['uid', '_id'], ['time'], ['time', 'date', 'toisoformat']]
+    ei = ElasticIndex(None, 'dbes-test-mpgenerate',
+                      mapper=ElasticDocument(docmap))
+    docs = [dict(d, uid=str(i)) for i in range(50) for d in issrecords]
+    expected = list(ei._generate(docs))
+    assert list(ei._mpgenerate(docs, 3, batchsize=7)) == expected
+    assert list(ei._mpgenerate([], 2)) == []
+    return
+
+
+def test_versions_publish(es):
+    ei = ElasticIndex(es, 'dbes-test-bluegreen')
+    ei.devour([{"_id": 1, "fruit": "apple"}])
+    assert ei.versions() == []
+    for n in range(1, 4):
+        target = ei.nextversion()
+        assert target.index == 'dbes-test-bluegreen-v{}'.format(n)
+        target.devour([{"_id": i, "fruit": "kiwi"} for i in range(n)])
+        ei.publish(target.index, keep=2)
+        assert ei.qsearch('*')['hits']['total'] == n
+    assert es.indices.exists_alias(name=ei.index)
+    assert ei.versions() == [2, 3]
+    # writes through the alias go to the latest version
+    assert ei.ingest({"_id": 9, "fruit": "lime"}) == 1
+    es.indices.refresh(index='dbes-test-bluegreen-v3')
+    assert es.cat.count('dbes-test-bluegreen-v3', h='count').strip() == '4'
+    return
+
+
+def test_bulkload(es):
+    ei = ElasticIndex(es, 'dbes-test-bulkload')
+    ei.reset()
+
+    def settings():
+        res = es.indices.get_settings(index=ei.index)
+        return res[ei.index]['settings']['index']
+
+    replicas = settings()['number_of_replicas']
+    with ei.bulkload(forcemerge=True):
+        assert settings()['refresh_interval'] == '-1'
+        assert settings()['number_of_replicas'] == '0'
+        ei.devour([{"_id": i} for i in range(10)])
+    assert 'refresh_interval' not in settings()
+    assert settings()['number_of_replicas'] == replicas
+    assert ei.qsearch('*')['hits']['total'] == 10
+    # settings left by a crash within bulkload are reset to defaults
+    es.indices.put_settings(index=ei.index, body={"index": {
+        "refresh_interval": "-1", "number_of_replicas": 0}})
+    with ei.bulkload():
+        pass
+    assert 'refresh_interval' not in settings()
+    assert settings()['number_of_replicas'] == '1'
+    return
+
+
+def test_from_config_mapping(es):
+    from elasticsearch.exceptions import RequestError
+    docmap = [['uid', '_id', str], ['n', 'n', int], ['e0', 'e0', float],
+              ['time'], ['time', 'date', 'toisoformat'],
+              ['formula', 'composition', 'normalize_counts']]
+    config = {'databroker-elasticsearch': {
+        'host': 'localhost', 'index': 'dbes-test-mapping',
+        'docmap': docmap, 'hashfield': 'chash'}}
+    ei = ElasticIndex.from_config(config)
+    ei.es = es
+    assert ei.doc_dynamic == 'strict'
+    assert ei.doc_properties['time'] == {
+        "type": "date", "format": "epoch_second"}
+    ei.reset()
+    res = es.indices.get_mapping(index=ei.index)
+    mapping = res[ei.index]['mappings'][ei.doc_type]
+    assert mapping['dynamic'] == 'strict'
+    assert mapping['properties']['e0'] == {'type': 'double'}
+    doc = {'uid': 'a', 'n': '3', 'e0': '4966', 'time': 1518309396.775,
+           'formula': {'Ti': 1, 'O': 2}}
+    assert ei.devour([doc]) == 1
+    src = es.get(index=ei.index, doc_type=ei.doc_type, id='a')['_source']
+    assert src['e0'] == 4966.0
+    with pytest.raises(RequestError):
+        es.index(index=ei.index, doc_type=ei.doc_type, id='b',
+                 body={'unknown': 1})
+    config['databroker-elasticsearch']['docmap'].append(['comment'])
+    assert ElasticIndex.from_config(config).doc_dynamic is True
+    return
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""\
+Test the EventStats class.
+"""
+
+import pytest
+
+from databroker_elasticsearch.eventstats import EventStats
+
+
+@pytest.fixture
+def stats():
+    rv = EventStats()
+    rv.add_descriptor({
+        'uid': 'd1',
+        'data_keys': {
+            'I0': {'dtype': 'number', 'shape': []},
+            'cnt': {'dtype': 'integer', 'shape': []},
+            'img': {'dtype': 'array', 'shape': [10, 10]},
+            'name': {'dtype': 'string', 'shape': []},
+        },
+    })
+    return rv
+
+
+def test_add_descriptor(stats):
+    assert stats.scalarkeys == {'d1': ['I0', 'cnt']}
+    return
+
+
+def test_event_and_page(stats):
+    stats.add_event({'descriptor': 'd1', 'data': {'I0': 2.0, 'img': 0}})
+    stats.add_event_page({'descriptor': 'd1',
+                          'data': {'I0': [4.0, float('nan'), 9.0],
+                                   'cnt': [1, 2]}})
+    # events of unknown descriptor are ignored
+    stats.add_event({'descriptor': 'd2', 'data': {'I0': 100.0}})
+    s = stats.summary()
+    assert set(s) == {'I0', 'cnt'}
+    assert s['I0'] == {'count': 3, 'min': 2.0, 'max': 9.0, 'mean': 5.0}
+    assert s['cnt'] == {'count': 2, 'min': 1.0, 'max': 2.0, 'mean': 1.5}
+    return
+
+
+def test_bad_values(stats):
+    stats.add_event({'descriptor': 'd1', 'data': {'I0': None}})
+    stats.add_event({'descriptor': 'd1', 'data': {'I0': 'x'}})
+    assert stats.summary() == {}
+    return
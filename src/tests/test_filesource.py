@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""\
+Test streaming of documents from JSON files.
+"""
+
+import gzip
+import io
+import json
+
+import pytest
+
+from databroker_elasticsearch.filesource import startdocs
+from conftest import tdatafile
+
+
+def test_startdocs_array(issrecords):
+    assert list(startdocs(tdatafile('iss-sample.json'))) == issrecords
+    # small buffer splits the documents
+    fp = open(tdatafile('iss-sample.json'))
+    assert list(startdocs(fp, bufsize=7)) == issrecords
+    assert fp.closed is False
+    fp.close()
+    assert list(startdocs(io.StringIO('  \n [ ] '), bufsize=1)) == []
+    return
+
+
+def test_startdocs_ndjson(issrecords, tmp_path):
+    text = ''.join(json.dumps(d) + '\n' for d in issrecords)
+    assert list(startdocs(io.StringIO(text), bufsize=5)) == issrecords
+    assert list(startdocs(io.StringIO(''))) == []
+    filename = str(tmp_path / 'dump.ndjson.gz')
+    with gzip.open(filename, 'wt') as fp:
+        fp.write(text)
+    assert list(startdocs(filename)) == issrecords
+    return
+
+
+def test_startdocs_invalid():
+    with pytest.raises(ValueError):
+        list(startdocs(io.StringIO('[{"a": 1} {"b": 2}]')))
+    with pytest.raises(ValueError):
+        list(startdocs(io.StringIO('[{"a": 1}, {"b": 2}'), bufsize=4))
+    with pytest.raises(ValueError):
+        list(startdocs(io.StringIO('{"a": 1}\n{"b": ')))
+    # malformed document fails without reading the rest of the stream
+    fp = io.StringIO('{"a": x, "b": 1}' + 1000 * '\n{"c": 1}')
+    with pytest.raises(ValueError):
+        list(startdocs(fp, bufsize=20))
+    assert fp.tell() == 20
+    return
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""\
+Test the IngestWorker class.
+"""
+
+import threading
+import time
+
+import pytest
+
+from databroker_elasticsearch.ingestworker import IngestWorker
+
+
+class Recorder:
+    "Mock send function which records documents in each call."
+
+    def __init__(self):
+        self.docs = []
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        return
+
+    def __call__(self, docs):
+        self.gate.wait()
+        if any(d.get('fail') for d in docs):
+            raise RuntimeError('simulated failure')
+        self.batches.append(list(docs))
+        self.docs.extend(docs)
+        return len(docs)
+
+
+def test_submit_flush():
+    rec = Recorder()
+    w = IngestWorker(rec, maxsize=10)
+    rec.gate.clear()
+    for i in range(3):
+        w.submit({'_id': i})
+    assert w.qsize >= 2
+    rec.gate.set()
+    w.flush()
+    assert w.qsize == 0
+    assert [d['_id'] for d in rec.docs] == [0, 1, 2]
+    w.close()
+    return
+
+
+def test_failure_is_logged(caplog):
+    rec = Recorder()
+    w = IngestWorker(rec)
+    w.submit({'_id': 1, 'fail': True})
+    w.submit({'_id': 2})
+    w.close()
+    assert [d['_id'] for d in rec.docs] == [2]
+    assert 'Failed to insert' in caplog.text
+    return
+
+
+def test_close():
+    rec = Recorder()
+    w = IngestWorker(rec)
+    w.submit({'_id': 1})
+    w.close()
+    assert w.closed
+    assert len(rec.docs) == 1
+    w.close()
+    with pytest.raises(RuntimeError):
+        w.submit({'_id': 2})
+    return
+
+
+def test_batchsize():
+    rec = Recorder()
+    w = IngestWorker(rec, batchsize=3, batchtime=60)
+    for i in range(7):
+        w.submit({'_id': i})
+    w.flush()
+    assert [len(b) for b in rec.batches] == [3, 3, 1]
+    w.close()
+    return
+
+
+def test_batchtime():
+    rec = Recorder()
+    w = IngestWorker(rec, batchsize=100, batchtime=0.05)
+    w.submit({'_id': 1})
+    w.submit({'_id': 2})
+    t0 = time.monotonic()
+    while not rec.batches and time.monotonic() - t0 < 5:
+        time.sleep(0.01)
+    assert rec.batches == [[{'_id': 1}, {'_id': 2}]]
+    # flush without waiting sends pending batch before its time limit
+    w.batchtime = 60
+    w.submit({'_id': 3})
+    w.flush(wait=False)
+    w.close()
+    assert len(rec.batches) == 2
+    return
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+"""\
+Test the Progress class.
+"""
+
+import io
+
+from databroker_elasticsearch.progress import Progress
+
+
+def test_update():
+    p = Progress(total=4, interval=1e9, stream=io.StringIO())
+    p.read, p.mapped = 4, 3
+    assert p.filtered == 1
+    p.update()
+    assert p.stream.getvalue() == ''
+    return
+
+
+def test_report():
+    p = Progress(total=10, interval=0, stream=io.StringIO())
+    p.read = p.mapped = p.sent = p.acked = 5
+    p.bytes = 1000
+    p.update()
+    line = p.stream.getvalue()
+    assert line.startswith('read 5/10 filtered 0 mapped 5 sent 5 acked 5')
+    assert 'bytes 1000' in line and 'docs/s' in line and 'ETA' in line
+    assert p.rate > 0
+    assert p.eta > 0
+    p.read = 10
+    p.done()
+    assert p.eta == 0
+    assert len(p.stream.getvalue().splitlines()) == 2
+    return
+
+
+def test_unknown_total():
+    p = Progress(stream=io.StringIO())
+    p.read = 3
+    p.done()
+    assert p.eta is None
+    assert 'ETA' not in p.stream.getvalue()
+    assert 'read 3 ' in p.stream.getvalue()
+    return
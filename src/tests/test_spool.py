@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""\
+Test the DocumentSpool class.
+"""
+
+import os
+
+import pytest
+
+from databroker_elasticsearch.spool import DocumentSpool
+
+
+class UploadIndex:
+    "Mock ElasticIndex which records uploaded entries."
+
+    def __init__(self):
+        self.entries = []
+        self.updates = []
+        self.online = True
+        return
+
+    def upload(self, entries, stats=False, **kwargs):
+        if not self.online:
+            raise ConnectionError('simulated outage')
+        bst = simulated(entries, 'index')
+        self.entries.extend(bst.sent)
+        return bst if stats else bst.indexed
+
+    def amend(self, updates, stats=False):
+        bst = simulated(updates, 'update')
+        self.updates.extend(bst.sent)
+        return bst if stats else bst.indexed
+
+
+def simulated(entries, op):
+    "Return BulkStats of entries with result status from their body."
+    from databroker_elasticsearch.bulkstats import BulkStats
+    bst = BulkStats()
+    bst.sent = []
+    for i, src in entries:
+        status = src.get('status', 201)
+        item = {op: {'_id': str(i), 'status': status}}
+        if status == 201:
+            bst.sent.append((i, src))
+        else:
+            item[op]['error'] = {'type': 'simulated'}
+        bst.add(status == 201, item)
+    return bst
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return DocumentSpool(str(tmp_path / 'dbes.spool'))
+
+
+def test_append_read(spool):
+    assert len(spool) == 0
+    assert list(spool.read()) == []
+    spool.append([('a', {'x': 1}), ('b', {'x': 2})])
+    spool.append([])
+    spool.append(iter([('c', {'y': [1, 2]})]))
+    assert len(spool) == 3
+    assert list(spool.read())[-1] == ('c', {'y': [1, 2]})
+    spool.clear()
+    assert len(spool) == 0
+    return
+
+
+def test_partial_line(spool):
+    spool.append([('a', {'x': 1})])
+    with open(spool.filename, 'a') as fp:
+        fp.write('["b", {"x"')
+    assert list(spool.read()) == [('a', {'x': 1})]
+    return
+
+
+def test_replay(spool):
+    ei = UploadIndex()
+    assert spool.replay(ei) == 0
+    ei.online = False
+    spool.append([('a', {'x': 1})])
+    with pytest.raises(ConnectionError):
+        spool.replay(ei)
+    spool.append([('b', {'x': 2})])
+    assert len(spool) == 2
+    ei.online = True
+    assert spool.replay(ei) == 2
+    assert len(spool) == 0
+    assert [e[0] for e in ei.entries] == ['a', 'b']
+    return
+
+
+def test_updates(spool):
+    ei = UploadIndex()
+    spool.append([('a', {'x': 1})])
+    spool.append([('a', {'y': 2})], op='update')
+    with pytest.raises(ValueError):
+        spool.append([('a', {})], op='delete')
+    assert len(spool) == 2
+    assert list(spool.read()) == [('a', {'x': 1})]
+    assert list(spool.read(op='update')) == [('a', {'y': 2})]
+    assert spool.replay(ei) == 2
+    assert ei.updates == [('a', {'y': 2})]
+    return
+
+
+def test_replay_failures(spool):
+    ei = UploadIndex()
+    spool.append([('a', {'x': 1}), ('b', {'status': 400}),
+                  (3, {'status': 429})])
+    assert spool.replay(ei) == 1
+    assert list(spool.read()) == [(3, {'status': 429})]
+    assert not os.path.exists(spool.filename + '.tmp')
+    return
+
+
+def test_replay_updates_kept(spool):
+    ei = UploadIndex()
+    spool.append([('a', {'x': 1}), ('b', {'status': 429})])
+    spool.append([('a', {'status': 429}), ('b', {'y': 2}),
+                  ('c', {'status': 404})], op='update')
+    assert spool.replay(ei) == 1
+    assert list(spool.read()) == [('b', {'status': 429})]
+    assert list(spool.read(op='update')) == [
+        ('a', {'status': 429}), ('b', {'y': 2})]
+    assert ei.updates == []
+    return